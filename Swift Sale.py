@@ -1,12 +1,31 @@
-import mysql.connector
+import time
+STARTUP_T0 = time.perf_counter()
 import datetime
-import io
 import os
+import gzip
+import hashlib
+import importlib
+import importlib.util
+import io
 import random
+import re
+import socket
+import sqlite3
+import sys
 import threading
+import traceback
+import uuid
 import math
-from functools import partial
-from flask import Flask
+import bisect
+import csv
+import heapq
+import json
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, lru_cache
+from collections import OrderedDict
+from html import escape
+from decimal import Decimal, ROUND_HALF_UP
 from kivy.app import App
 from kivy.lang import Builder
 from kivy.uix.screenmanager import ScreenManager, Screen, NoTransition
@@ -22,20 +41,95 @@ from kivy.uix.popup import Popup
 from kivy.uix.carousel import Carousel
 from kivy.metrics import dp, sp
 from kivy.core.window import Window
-from kivy.core.image import Image as CoreImage
-from kivy.graphics import Color, RoundedRectangle, Line, Rectangle, Ellipse
+from kivy.graphics import Color, RoundedRectangle, Line, Rectangle, Ellipse, PushMatrix, PopMatrix, Translate, Scale
+from kivy.graphics.texture import Texture
 from kivy.properties import StringProperty, ListProperty, NumericProperty, ObjectProperty, BooleanProperty
 from kivy.utils import get_color_from_hex
 from kivy.clock import Clock
 from kivy.uix.spinner import Spinner
 from kivy.uix.dropdown import DropDown
 
-# try to import qrcode if installed
-try:
-    import qrcode
-    HAS_QRCODE = True
-except ImportError:
-    HAS_QRCODE = False
+# startup settings, the login screen should be on screen within 'budget' seconds
+STARTUP_CONFIG = {
+    'budget': 1.5,
+    'report': True
+}
+
+# when each startup step finished, printed once the first frame is drawn
+class StartupTimer:
+    def __init__(self, t0, budget=1.5, report=True):
+        self.t0 = t0
+        self.budget = budget
+        self.enabled = report
+        self.marks = []
+        self.reported = False
+        self._lock = threading.Lock()
+
+    def mark(self, step, took=None):
+        at = time.perf_counter() - self.t0
+        with self._lock:
+            self.marks.append((step, at, took))
+            late = self.reported
+        # steps that finish in the background after the report get a line of their own
+        if late and self.enabled: print(f"Startup: {self._line(step, at, took).strip()}")
+
+    def _line(self, step, at, took):
+        return f"{at*1000:7.0f} ms  {step}" + (f" ({took*1000:.0f} ms)" if took is not None else "")
+
+    def report(self):
+        with self._lock:
+            marks, self.reported = list(self.marks), True
+        if not self.enabled: return
+        first_frame = marks[-1][1] if marks else 0
+        verdict = "within" if first_frame <= self.budget else "OVER"
+        print(f"Startup ({verdict} {self.budget*1000:.0f} ms budget)")
+        for step, at, took in marks:
+            print(self._line(step, at, took))
+
+startup = StartupTimer(STARTUP_T0, **STARTUP_CONFIG)
+
+# stands in for a heavy module and imports it the first time it is used
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    @staticmethod
+    def _import(name):
+        started = time.perf_counter()
+        module = importlib.import_module(name)
+        startup.mark(f"imported {name}", time.perf_counter() - started)
+        return module
+
+    def __getattr__(self, attr):
+        if self._module is None: self._module = self._import(self._name)
+        try:
+            return getattr(self._module, attr)
+        except AttributeError:
+            # a submodule nobody imported yet, eg. mysql.connector
+            return self._import(f"{self._name}.{attr}")
+
+startup.mark("kivy imported")
+
+mysql = LazyModule('mysql')
+flask = LazyModule('flask')
+
+# qrcode and waitress are optional, look for them without paying for the import
+qrcode = LazyModule('qrcode')
+HAS_QRCODE = importlib.util.find_spec('qrcode') is not None
+
+# waitress is the preferred receipt server, werkzeug's is the fallback
+HAS_WAITRESS = importlib.util.find_spec('waitress') is not None
+
+# pyarrow adds parquet files to sales exports
+pyarrow = LazyModule('pyarrow')
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+# storage settings, set per deployment. 'mysql' shares one server between tills, 'sqlite'
+# keeps everything in a local file for a single-till shop and needs no server at all
+STORAGE_CONFIG = {
+    'backend': os.environ.get('SWIFTSALE_STORAGE', 'mysql')
+}
 
 # database settings
 DB_CONFIG = {
@@ -45,40 +139,982 @@ DB_CONFIG = {
     'database': 'SwiftSale_DB'
 }
 
+# embedded engine settings, cache and mmap sizes are per connection
+SQLITE_CONFIG = {
+    'path': 'swiftsale.db',
+    'cache_mb': 64,
+    'mmap_mb': 256,
+    'statement_cache': 256,
+    'busy_timeout': 5,
+    'synchronous': 'FULL'
+}
+
+# the queries are written for mysql, a backend carries the connections and whatever
+# sql differs: ddl, schema lookups, locks and bulk loading
+class MySQLBackend:
+    name = 'mysql'
+
+    def __init__(self, host, user, password, database):
+        self.config = {'host': host, 'user': user, 'password': password, 'database': database}
+
+    @property
+    def Error(self):
+        return mysql.connector.Error
+
+    def connect(self):
+        # consume_results so a half-read cursor does not poison a pooled connection
+        return mysql.connector.connect(consume_results=True, **self.config)
+
+    def create_database(self):
+        # connect to the server first, the pool needs the database to exist
+        conn = mysql.connector.connect(host=self.config['host'], user=self.config['user'], password=self.config['password'])
+        c = conn.cursor()
+        c.execute(f"CREATE DATABASE IF NOT EXISTS {self.config['database']}")
+        conn.close()
+
+    def pool_exhausted(self):
+        return mysql.connector.errors.PoolError("connection pool exhausted")
+
+    def unreachable(self, err):
+        # the server is out of reach rather than the statement being bad
+        errors = mysql.connector.errors
+        return isinstance(err, (errors.InterfaceError, errors.OperationalError, errors.PoolError))
+
+    def ddl(self, statement):
+        return [statement]
+
+    def index_columns(self, c, table):
+        # (index, column, non_unique) in index column order
+        c.execute("""SELECT index_name, column_name, non_unique FROM information_schema.statistics
+                     WHERE table_schema = DATABASE() AND table_name = %s ORDER BY index_name, seq_in_index""", (table,))
+        return c.fetchall()
+
+    def has_column(self, c, table, name):
+        c.execute("""SELECT 1 FROM information_schema.columns
+                     WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s""", (table, name))
+        return c.fetchone() is not None
+
+    # online ddl: reads and writes keep flowing while the table changes
+    def add_index(self, c, table, name, columns, unique=False):
+        c.execute(f"ALTER TABLE {table} ADD {'UNIQUE ' if unique else ''}INDEX {name} ({', '.join(columns)}), ALGORITHM=INPLACE, LOCK=NONE")
+
+    def drop_index(self, c, table, name):
+        c.execute(f"ALTER TABLE {table} DROP INDEX {name}, ALGORITHM=INPLACE, LOCK=NONE")
+
+    def add_column(self, c, table, name, definition):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}, ALGORITHM=INPLACE, LOCK=NONE")
+
+    @contextmanager
+    def migration_lock(self, c, wait):
+        # only one till migrates at a time, the others wait here and then find nothing to do
+        c.execute("SELECT GET_LOCK('swiftsale_migrate', 60)")
+        c.fetchone()
+        try:
+            c.execute("SET SESSION lock_wait_timeout = %s", (wait,))
+            yield
+        finally:
+            c.execute("SELECT RELEASE_LOCK('swiftsale_migrate')")
+            c.fetchone()
+
+    def bulk_load(self, c):
+        # this connection only, the checks come back when it closes
+        c.execute("SET SESSION foreign_key_checks = 0, unique_checks = 0")
+
+    def truncate(self, c, table):
+        c.execute(f"TRUNCATE TABLE {table}")
+
+    def table_rows(self, c):
+        # estimates, an exact count would scan every table
+        c.execute("SELECT table_name, table_rows FROM information_schema.tables WHERE table_schema = DATABASE()")
+        return {name: rows or 0 for name, rows in c.fetchall()}
+
+# mysql spellings the embedded engine lacks, rewritten once per distinct statement
+SQLITE_REWRITES = [
+    (re.compile(r"%s"), "?"),
+    (re.compile(r"ON DUPLICATE KEY UPDATE"), "ON CONFLICT DO UPDATE SET"),
+    (re.compile(r"\bVALUES\((\w+)\)"), r"excluded.\1"),
+    # a write transaction already holds the whole database
+    (re.compile(r"\s+FOR UPDATE\b"), ""),
+]
+
+@lru_cache(maxsize=1024)
+def sqlite_sql(sql):
+    for pattern, replacement in SQLITE_REWRITES:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+def _sqlite_date_format(value, fmt):
+    # the DATE_FORMAT codes used here (%Y %m %d %H) mean the same to strftime
+    if value is None: return None
+    return datetime.datetime.fromisoformat(str(value)).strftime(fmt)
+
+# enough of the mysql.connector cursor for this app, statements pass through sqlite_sql
+class SQLiteCursor:
+    def __init__(self, conn):
+        self._conn = conn
+        self._cur = conn.raw.cursor()
+        self._found = None
+        self.rowcount = -1
+
+    def execute(self, sql, params=()):
+        self._conn.found_id = None
+        self._cur.execute(sqlite_sql(sql), tuple(params))
+        self._settle()
+
+    def executemany(self, sql, seq):
+        self._conn.found_id = None
+        self._cur.executemany(sqlite_sql(sql), seq)
+        self._settle()
+
+    def _settle(self):
+        self._found = self._conn.found_id
+        # mysql counts an upsert that updated an existing row twice
+        self.rowcount = self._cur.rowcount * 2 if self._found is not None else self._cur.rowcount
+
+    @property
+    def lastrowid(self):
+        # LAST_INSERT_ID(id) in an upsert names the row it hit, same as on mysql
+        return self._found if self._found is not None else self._cur.lastrowid
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    @property
+    def column_names(self):
+        return tuple(d[0] for d in self._cur.description or ())
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchmany(self, size=1):
+        return self._cur.fetchmany(size)
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    def __iter__(self):
+        return iter(self._cur)
+
+    def close(self):
+        self._cur.close()
+
+class SQLiteConnection:
+    def __init__(self, raw):
+        self.raw = raw
+        self.found_id = None
+        # the mysql functions the queries call
+        raw.create_function('NOW', 0, lambda: datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        raw.create_function('GREATEST', -1, lambda *v: None if None in v else max(v), deterministic=True)
+        raw.create_function('CONCAT', -1, lambda *v: None if None in v else ''.join(map(str, v)), deterministic=True)
+        raw.create_function('DATE_FORMAT', 2, _sqlite_date_format, deterministic=True)
+        raw.create_function('LAST_INSERT_ID', 1, self._last_insert_id)
+
+    def _last_insert_id(self, value):
+        self.found_id = value
+        return value
+
+    def cursor(self, buffered=None, **kwargs):
+        # rows come off the file as they are fetched, buffered or not
+        return SQLiteCursor(self)
+
+    def start_transaction(self, consistent_snapshot=False, isolation_level=None, readonly=False):
+        # writers take the lock up front so two never deadlock upgrading, a reader's
+        # snapshot starts at its first select
+        self.raw.execute("BEGIN" if readonly else "BEGIN IMMEDIATE")
+
+    @property
+    def in_transaction(self):
+        return self.raw.in_transaction
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def ping(self, reconnect=False):
+        self.raw.execute("SELECT 1")
+
+    def close(self):
+        self.raw.close()
+
+class SQLiteBackend:
+    name = 'sqlite'
+    Error = sqlite3.Error
+
+    def __init__(self, path, cache_mb=64, mmap_mb=256, statement_cache=256, busy_timeout=5, synchronous='FULL'):
+        self.path = path
+        self.cache_mb = cache_mb
+        self.mmap_mb = mmap_mb
+        self.statement_cache = statement_cache
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous
+        # money stays Decimal and times stay datetime, as mysql.connector hands them back.
+        # every DECIMAL column here is to the paisa
+        sqlite3.register_adapter(Decimal, str)
+        sqlite3.register_adapter(datetime.datetime, lambda v: v.strftime("%Y-%m-%d %H:%M:%S"))
+        sqlite3.register_adapter(datetime.date, lambda v: v.isoformat())
+        sqlite3.register_converter('DECIMAL', lambda b: Decimal(b.decode()).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+        sqlite3.register_converter('DATETIME', lambda b: datetime.datetime.fromisoformat(b.decode()))
+
+    def connect(self):
+        # pooled connections move between threads, one at a time. each keeps its own
+        # compiled statements, so repeated queries skip the parser
+        raw = sqlite3.connect(self.path, timeout=self.busy_timeout, detect_types=sqlite3.PARSE_DECLTYPES,
+                              isolation_level='IMMEDIATE', check_same_thread=False,
+                              cached_statements=self.statement_cache)
+        # readers never block the writer and a commit appends to the wal instead of rewriting pages
+        raw.execute("PRAGMA journal_mode = WAL")
+        raw.execute(f"PRAGMA synchronous = {self.synchronous}")
+        raw.execute(f"PRAGMA cache_size = -{self.cache_mb * 1024}")
+        raw.execute(f"PRAGMA mmap_size = {self.mmap_mb * 1024 * 1024}")
+        raw.execute("PRAGMA temp_store = MEMORY")
+        raw.execute("PRAGMA foreign_keys = ON")
+        return SQLiteConnection(raw)
+
+    def create_database(self):
+        folder = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(folder, exist_ok=True)
+
+    def pool_exhausted(self):
+        return sqlite3.OperationalError("connection pool exhausted")
+
+    def unreachable(self, err):
+        # the file is always there, busy is the only thing worth waiting out
+        return isinstance(err, sqlite3.OperationalError)
+
+    def ddl(self, statement):
+        # sqlite spells auto increment its own way and wants indexes outside CREATE TABLE
+        table = re.search(r"CREATE TABLE IF NOT EXISTS (\w+)", statement).group(1)
+        inline = re.compile(r",\s*(UNIQUE\s+)?(?:INDEX|KEY)\s+(\w+)\s*\(([^)]*)\)")
+        indexes = [f"CREATE {unique or ''}INDEX IF NOT EXISTS {name} ON {table} ({cols})"
+                   for unique, name, cols in inline.findall(statement)]
+        statement = inline.sub("", statement).replace("INT AUTO_INCREMENT PRIMARY KEY", "INTEGER PRIMARY KEY AUTOINCREMENT")
+        return [statement] + indexes
+
+    def index_columns(self, c, table):
+        c.execute("""SELECT il.name, ii.name, NOT il."unique" FROM pragma_index_list(%s) il, pragma_index_info(il.name) ii
+                     ORDER BY il.name, ii.seqno""", (table,))
+        return c.fetchall()
+
+    def has_column(self, c, table, name):
+        c.execute("SELECT 1 FROM pragma_table_info(%s) WHERE name = %s", (table, name))
+        return c.fetchone() is not None
+
+    def add_index(self, c, table, name, columns, unique=False):
+        c.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+
+    def drop_index(self, c, table, name):
+        c.execute(f"DROP INDEX IF EXISTS {name}")
+
+    def add_column(self, c, table, name, definition):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+    @contextmanager
+    def migration_lock(self, c, wait):
+        # one till per file, nobody to wait for
+        yield
+
+    def bulk_load(self, c):
+        c.execute("PRAGMA foreign_keys = OFF")
+
+    def truncate(self, c, table):
+        c.execute(f"DELETE FROM {table}")
+        c.execute("DELETE FROM sqlite_sequence WHERE name = %s", (table,))
+
+    def table_rows(self, c):
+        # counting is cheap on a local file
+        c.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+        counts = {}
+        for (name,) in c.fetchall():
+            c.execute(f"SELECT COUNT(*) FROM {name}")
+            counts[name] = c.fetchone()[0]
+        return counts
+
+STORAGE_BACKENDS = {
+    'mysql': (MySQLBackend, DB_CONFIG),
+    'sqlite': (SQLiteBackend, SQLITE_CONFIG)
+}
+
+def create_storage(name):
+    backend, settings = STORAGE_BACKENDS[name]
+    return backend(**settings)
+
+storage = create_storage(STORAGE_CONFIG['backend'])
+
+# connection pool settings
+POOL_CONFIG = {
+    'size': 5,
+    'idle_timeout': 300,
+    'acquire_timeout': 10
+}
+
+# query instrumentation settings, latency buckets are in seconds
+METRICS_CONFIG = {
+    'enabled': True,
+    'buckets': (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    'max_series': 500,
+    'refresh_interval': 2
+}
+
+@lru_cache(maxsize=2048)
+def statement_fingerprint(sql):
+    # literals, placeholder lists and multi-row VALUES folded, so one statement shape is one series
+    text = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    text = re.sub(r"\b\d+(?:\.\d+)?\b", "?", text).replace("%s", "?")
+    text = re.sub(r"\s+", " ", text).strip()
+    text = re.sub(r"(?:WHEN \? THEN \? )+", "WHEN ? THEN ? ", text)
+    text = re.sub(r"\(\?(?:, \?)+\)", "(?+)", text)
+    return re.sub(r"\(\?\+\)(?:, \(\?\+\))+", "(?+), ...", text)
+
+class LatencyHistogram:
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'rows', 'errors')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.rows = 0
+        self.errors = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-th observation, inf past the last bucket
+        target, seen = q * self.count, 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= target: return bound
+        return math.inf
+
+# per statement and call site timings, kept in memory and read by /metrics and the diagnostics screen
+class QueryMetrics:
+    def __init__(self, enabled=True, buckets=(), max_series=500, refresh_interval=2):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.max_series = max_series
+        self.acquire = LatencyHistogram(self.buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        self._skip = set()
+        self._sites = {}
+
+    def skip(self, fn):
+        # decorator for db plumbing, its statements are charged to whoever called it
+        self._skip.add(fn.__code__)
+        return fn
+
+    def call_site(self):
+        # Class.method or function that ran the statement, nested workers keep the method they live in
+        frame = sys._getframe(1)
+        while frame is not None and frame.f_code in self._skip:
+            frame = frame.f_back
+        if frame is None: return "unknown"
+        code = frame.f_code
+        site = self._sites.get(code)
+        if site is None:
+            site = self._sites[code] = getattr(code, 'co_qualname', code.co_name).replace('.<locals>', '')
+        return site
+
+    def observe(self, sql, site, seconds, rows=0, failed=False):
+        # returns the series key so rows fetched later can be added to it
+        key = (statement_fingerprint(sql), site)
+        with self._lock:
+            hist = self._series.get(key)
+            if hist is None:
+                if len(self._series) >= self.max_series:
+                    key = ("(other statements)", site)
+                    hist = self._series.get(key)
+                if hist is None:
+                    hist = self._series[key] = LatencyHistogram(self.buckets)
+            hist.observe(seconds)
+            hist.rows += rows
+            if failed: hist.errors += 1
+        return key
+
+    def add_rows(self, key, n):
+        if key is None or not n: return
+        with self._lock:
+            hist = self._series.get(key)
+            if hist is not None: hist.rows += n
+
+    def observe_acquire(self, seconds):
+        with self._lock:
+            self.acquire.observe(seconds)
+
+    def snapshot(self):
+        # [(fingerprint, site, histogram)] most total time first, copies safe to read anywhere
+        with self._lock:
+            series = [(fp, site, self._copy(hist)) for (fp, site), hist in self._series.items()]
+            acquire = self._copy(self.acquire)
+        series.sort(key=lambda s: s[2].sum, reverse=True)
+        return acquire, series
+
+    def _copy(self, hist):
+        clone = LatencyHistogram(self.buckets)
+        clone.counts = list(hist.counts)
+        clone.count, clone.sum, clone.rows, clone.errors = hist.count, hist.sum, hist.rows, hist.errors
+        return clone
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+            self.acquire = LatencyHistogram(self.buckets)
+
+    def prometheus(self, gauges=()):
+        # text exposition format, gauges are (name, help, value) read at scrape time
+        acquire, series = self.snapshot()
+        lines = []
+        def histogram(name, labels, hist):
+            cumulative = 0
+            for bound, n in zip(self.buckets, hist.counts):
+                cumulative += n
+                lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {hist.count}')
+            lines.append(f'{name}_sum{{{labels.rstrip(",")}}} {hist.sum:.6f}')
+            lines.append(f'{name}_count{{{labels.rstrip(",")}}} {hist.count}')
+        ids = {fp: hashlib.sha1(fp.encode()).hexdigest()[:10] for fp, _, _ in series}
+        labels = {(fp, site): f'statement="{ids[fp]}",site="{_label(site)}",' for fp, site, _ in series}
+
+        lines += ["# HELP swiftsale_query_seconds Statement execution time by statement and call site",
+                  "# TYPE swiftsale_query_seconds histogram"]
+        for fp, site, hist in series: histogram("swiftsale_query_seconds", labels[fp, site], hist)
+        lines += ["# HELP swiftsale_query_rows_total Rows returned or changed",
+                  "# TYPE swiftsale_query_rows_total counter"]
+        lines += [f'swiftsale_query_rows_total{{{labels[fp, site].rstrip(",")}}} {hist.rows}' for fp, site, hist in series]
+        lines += ["# HELP swiftsale_query_errors_total Statements that raised",
+                  "# TYPE swiftsale_query_errors_total counter"]
+        lines += [f'swiftsale_query_errors_total{{{labels[fp, site].rstrip(",")}}} {hist.errors}' for fp, site, hist in series]
+        lines += ["# HELP swiftsale_statement_info Statement text behind each statement id",
+                  "# TYPE swiftsale_statement_info gauge"]
+        lines += [f'swiftsale_statement_info{{statement="{sid}",sql="{_label(fp)}"}} 1' for fp, sid in ids.items()]
+        lines += ["# HELP swiftsale_pool_acquire_seconds Time to borrow a pooled connection",
+                  "# TYPE swiftsale_pool_acquire_seconds histogram"]
+        histogram("swiftsale_pool_acquire_seconds", "", acquire)
+        for name, help_text, value in gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+query_metrics = QueryMetrics(**METRICS_CONFIG)
+
+# times every statement on the wrapped cursor, everything else passes straight through
+class InstrumentedCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._key = None
+
+    @query_metrics.skip
+    def execute(self, sql, *args, **kwargs):
+        return self._timed(self._cursor.execute, sql, args, kwargs)
+
+    @query_metrics.skip
+    def executemany(self, sql, *args, **kwargs):
+        return self._timed(self._cursor.executemany, sql, args, kwargs)
+
+    @query_metrics.skip
+    def _timed(self, run, sql, args, kwargs):
+        site = query_metrics.call_site()
+        started = time.perf_counter()
+        try:
+            result = run(sql, *args, **kwargs)
+        except Exception:
+            self._key = query_metrics.observe(sql, site, time.perf_counter() - started, failed=True)
+            raise
+        took = time.perf_counter() - started
+        # selects count their rows as they are fetched, everything else what it changed
+        rows = 0 if self._cursor.description else max(self._cursor.rowcount, 0)
+        self._key = query_metrics.observe(sql, site, took, rows)
+        return result
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None: query_metrics.add_rows(self._key, 1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        query_metrics.add_rows(self._key, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        query_metrics.add_rows(self._key, len(rows))
+        return rows
+
+    def __iter__(self):
+        for row in self._cursor:
+            query_metrics.add_rows(self._key, 1)
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class InstrumentedConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
 # helper to get connection
 def get_db_connection():
-    return mysql.connector.connect(**DB_CONFIG)
+    conn = storage.connect()
+    return InstrumentedConnection(conn) if query_metrics.enabled else conn
 
-def init_db():
-    # connect to server first to create db
+# keeps a few open connections around so we skip the connect handshake
+class ConnectionPool:
+    def __init__(self, size=5, idle_timeout=300, acquire_timeout=10):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self._idle = []
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._local = threading.local()
+
+    def _healthy(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except storage.Error:
+            return False
+
+    def _discard(self, conn):
+        try: conn.close()
+        except storage.Error: pass
+
+    def _evict_idle(self):
+        # drop connections nobody used for a while, server may have killed them anyway
+        cutoff = time.monotonic() - self.idle_timeout
+        stale = [conn for conn, last_used in self._idle if last_used < cutoff]
+        self._idle = [(conn, last_used) for conn, last_used in self._idle if last_used >= cutoff]
+        return stale
+
+    def acquire(self):
+        # same thread asking again gets the connection it already holds
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            self._local.depth += 1
+            return held
+
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            stale = self._evict_idle()
+            while not self._idle and self._in_use >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise storage.pool_exhausted()
+                self._cond.wait(remaining)
+            conn = self._idle.pop()[0] if self._idle else None
+            self._in_use += 1
+        for s in stale: self._discard(s)
+
+        try:
+            if conn is not None and not self._healthy(conn):
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = get_db_connection()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        self._local.conn = conn
+        self._local.depth = 1
+        # waiting for a free slot and any reconnect, what the caller actually felt
+        query_metrics.observe_acquire(time.perf_counter() - started)
+        return conn
+
+    def release(self, conn):
+        if getattr(self._local, 'conn', None) is conn:
+            self._local.depth -= 1
+            if self._local.depth > 0: return
+            self._local.conn = None
+        # throw away anything left uncommitted so the next borrower starts clean
+        try:
+            conn.rollback()
+        except storage.Error:
+            self._discard(conn)
+            conn = None
+        with self._cond:
+            self._in_use -= 1
+            if conn is not None:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def stats(self):
+        # (in use, idle) right now
+        with self._cond:
+            return self._in_use, len(self._idle)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle: self._discard(conn)
+
+db_pool = ConnectionPool(**POOL_CONFIG)
+
+# borrow a pooled connection, always handed back even if the block raises
+@contextmanager
+def db_connection():
+    conn = db_pool.acquire()
     try:
-        conn = mysql.connector.connect(
-            host=DB_CONFIG['host'],
-            user=DB_CONFIG['user'],
-            password=DB_CONFIG['password']
-        )
-        c = conn.cursor()
-        c.execute(f"CREATE DATABASE IF NOT EXISTS {DB_CONFIG['database']}")
-        conn.close()
-    except mysql.connector.Error as err:
-        print(f"Error creating database: {err}")
-        return
+        yield conn
+    finally:
+        db_pool.release(conn)
 
-    # connect to actual db and make tables
-    conn = get_db_connection()
+# background query settings
+DB_EXECUTOR_CONFIG = {
+    'workers': 2
+}
+
+# set once init_db has finished in the background, queued db work waits for it
+schema_ready = threading.Event()
+
+# runs queries off the kivy thread and hands results back through the Clock
+class DBExecutor:
+    def __init__(self, workers=2):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='swiftsale-db')
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def _is_stale(self, key, token):
+        if key is None: return False
+        latest = self._latest.get(key)
+        return latest is None or latest[0] is not token
+
+    def _run(self, fn, key, token):
+        # skip work a newer request already replaced
+        with self._lock:
+            if self._is_stale(key, token): return None
+        schema_ready.wait()
+        with db_connection() as conn:
+            return fn(conn)
+
+    def _deliver(self, key, token, callback, errback, future):
+        if future.cancelled(): return
+        exc = future.exception()
+        Clock.schedule_once(lambda dt: self._finish(key, token, callback, errback, future, exc), 0)
+
+    def _finish(self, key, token, callback, errback, future, exc):
+        with self._lock:
+            if self._is_stale(key, token): return
+            if key is not None: del self._latest[key]
+        if exc is not None:
+            if errback: errback(exc)
+            elif isinstance(exc, storage.Error): print(f"Database error: {exc}")
+            else:
+                # raising here would take down the kivy loop, log it with its traceback instead
+                print(f"Background task failed: {exc!r}")
+                traceback.print_exception(type(exc), exc, exc.__traceback__)
+        elif callback:
+            callback(future.result())
+
+    def submit(self, fn, callback=None, errback=None, key=None):
+        # fn(conn) runs on a worker, callback(result) / errback(exc) run on the kivy thread
+        # a newer submit with the same key cancels the older one
+        token = object()
+        with self._lock:
+            prev = self._latest.get(key) if key is not None else None
+            future = self._pool.submit(self._run, fn, key, token)
+            if key is not None: self._latest[key] = (token, future)
+        if prev is not None: prev[1].cancel()
+        future.add_done_callback(partial(self._deliver, key, token, callback, errback))
+        return future
+
+    def cancel(self, key):
+        with self._lock:
+            prev = self._latest.pop(key, None)
+        if prev is not None: prev[1].cancel()
+
+    def shutdown(self):
+        with self._lock:
+            pending, self._latest = list(self._latest.values()), {}
+        for _, future in pending: future.cancel()
+        self._pool.shutdown(wait=False)
+
+db_executor = DBExecutor(**DB_EXECUTOR_CONFIG)
+
+# paged list settings
+BROWSE_CONFIG = {
+    'page_size': 100,
+    'prefetch': True,
+    'prefetch_screens': 2
+}
+
+# walks an ordered query one page at a time, each page seeks past the last row
+# it saw instead of using OFFSET so page 500 costs the same as page 1
+class KeysetPager:
+    def __init__(self, fetch, on_page, key, seek, page_size=None, prefetch=None):
+        self.fetch = fetch          # fetch(conn, after, limit, *args) -> rows
+        self.on_page = on_page      # on_page(rows, first) on the kivy thread
+        self.key = key
+        self.seek = seek            # seek(row) -> key tuple the next page starts after
+        self.page_size = page_size or BROWSE_CONFIG['page_size']
+        self.prefetch = BROWSE_CONFIG['prefetch'] if prefetch is None else prefetch
+        self.reset()
+
+    def reset(self, *args):
+        # drop whatever the previous query still had in flight
+        db_executor.cancel(self.key)
+        self.args = args
+        self.after = None
+        self.done = False
+        self.loading = False    # a page is being fetched
+        self.wanted = False     # and the list is waiting on it, rather than it being a prefetch
+        self.ahead = None       # next page, fetched before the list asked for it
+
+    def load_more(self):
+        if self.done: return
+        if self.ahead is not None:
+            rows, self.ahead = self.ahead, None
+            self._deliver(rows, False)
+        else:
+            self.wanted = True
+            if not self.loading: self._request()
+
+    def _request(self):
+        self.loading = True
+        after, args, limit = self.after, self.args, self.page_size
+        def load_page(conn):
+            return self.fetch(conn, after, limit, *args)
+        db_executor.submit(load_page, partial(self._loaded, after is None), self._failed, key=self.key)
+
+    def _loaded(self, first, rows):
+        self.loading = False
+        if self.wanted: self._deliver(rows, first)
+        else: self.ahead = rows
+
+    def _deliver(self, rows, first):
+        self.wanted = False
+        self.done = len(rows) < self.page_size
+        if rows: self.after = self.seek(rows[-1])
+        self.on_page(rows, first)
+        # fetch the following page while this one is being read
+        if self.prefetch and not self.done and not self.loading: self._request()
+
+    def _failed(self, err):
+        # the next load_more retries the page
+        self.loading = False
+        print(f"Error loading page: {err}")
+
+# rollup periods a sale counts towards: its day, its month and the all-time row
+def rollup_periods(when):
+    return [('day', when.strftime("%Y-%m-%d")), ('month', when.strftime("%Y-%m")), ('all', 'all')]
+
+# add one sale to the rollups, meant to run inside the checkout transaction
+def bump_rollups(c, when, total, discount, items, payments):
+    periods = rollup_periods(when)
+    paid = sum(amount for _, amount in payments)
+    c.executemany("""INSERT INTO sales_rollup (period_type, period, total, discount_total, paid_total, sale_count)
+                     VALUES (%s, %s, %s, %s, %s, 1)
+                     ON DUPLICATE KEY UPDATE total = total + VALUES(total), discount_total = discount_total + VALUES(discount_total),
+                                             paid_total = paid_total + VALUES(paid_total), sale_count = sale_count + 1""",
+                  [(pt, period, total, discount, paid) for pt, period in periods])
+    c.executemany("""INSERT INTO payment_rollup (period_type, period, method, amount, payment_count)
+                     VALUES (%s, %s, %s, %s, 1)
+                     ON DUPLICATE KEY UPDATE amount = amount + VALUES(amount), payment_count = payment_count + 1""",
+                  [(pt, period, method, amount) for pt, period in periods for method, amount in payments])
+    c.executemany("""INSERT INTO product_rollup (product_name, qty) VALUES (%s, %s)
+                     ON DUPLICATE KEY UPDATE qty = qty + VALUES(qty)""",
+                  [(item['name'], int(item['qty'])) for item in items])
+
+# recompute every rollup from sales history, for backfills and repairs
+def rebuild_rollups(conn):
+    c = conn.cursor()
+    for table in ('sales_rollup', 'payment_rollup', 'product_rollup'):
+        c.execute(f"DELETE FROM {table}")
+    periods = [('day', "DATE_FORMAT(s.date, '%Y-%m-%d')"), ('month', "DATE_FORMAT(s.date, '%Y-%m')"), ('all', "'all'")]
+    for pt, expr in periods:
+        c.execute(f"""INSERT INTO sales_rollup (period_type, period, total, discount_total, sale_count)
+                      SELECT '{pt}', {expr}, SUM(s.total), SUM(s.discount), COUNT(*) FROM sales s GROUP BY 2""")
+        # payments count towards the day of the sale they settle
+        c.execute(f"""INSERT INTO sales_rollup (period_type, period, paid_total)
+                      SELECT '{pt}', {expr}, SUM(p.amount) FROM payments p JOIN sales s ON s.id = p.sale_id GROUP BY 2
+                      ON DUPLICATE KEY UPDATE paid_total = VALUES(paid_total)""")
+        c.execute(f"""INSERT INTO payment_rollup (period_type, period, method, amount, payment_count)
+                      SELECT '{pt}', {expr}, p.method, SUM(p.amount), COUNT(*) FROM payments p JOIN sales s ON s.id = p.sale_id GROUP BY 2, 3""")
+    c.execute("""INSERT INTO product_rollup (product_name, qty)
+                 SELECT product_name, SUM(qty) FROM sales_items GROUP BY product_name""")
+
+# keyset paging can't seek past a NULL, so products without a category get ''
+def fill_blank_categories(conn):
+    c = conn.cursor()
+    c.execute("UPDATE products SET category = '' WHERE category IS NULL")
+
+# older databases can hold the same name twice, later copies get their id appended
+# so nothing is lost and sales_items keep pointing at the right row
+def dedupe_product_names(conn):
+    c = conn.cursor()
+    # the derived table lets mysql read products while updating it
+    c.execute("""UPDATE products SET name = CONCAT(name, ' #', id)
+                 WHERE id NOT IN (SELECT keep FROM (SELECT MIN(id) AS keep FROM products GROUP BY name) AS k)""")
+    conn.commit()
+
+# schema changes on top of the base tables, applied once each in order
+# and recorded in schema_version. ops are
+#   ('index' | 'unique', table, name, columns)
+#   ('drop_index', table, name)
+#   ('column', table, name, definition)
+#   ('table', name, create statement)
+#   ('call', fn) to backfill data, fn gets the connection
+MIGRATIONS = [
+    (1, "indexes for dashboard, receipt and customer lookup queries", [
+        ('index', 'sales', 'idx_sales_date', ['date']),
+        ('index', 'sales_items', 'idx_sales_items_sale', ['sale_id']),
+        ('index', 'sales_items', 'idx_sales_items_product', ['product_id']),
+        ('index', 'payments', 'idx_payments_sale', ['sale_id']),
+        ('index', 'payments', 'idx_payments_method', ['method']),
+        ('index', 'customers', 'idx_customers_phone', ['phone']),
+    ]),
+    (2, "daily, monthly and all-time sales rollups", [
+        ('column', 'sales', 'discount', "DECIMAL(10, 2) NOT NULL DEFAULT 0"),
+        ('index', 'products', 'idx_products_stock', ['stock']),
+        ('table', 'sales_rollup', """
+            CREATE TABLE IF NOT EXISTS sales_rollup (
+                period_type VARCHAR(5),
+                period VARCHAR(10),
+                total DECIMAL(14, 2) NOT NULL DEFAULT 0,
+                discount_total DECIMAL(14, 2) NOT NULL DEFAULT 0,
+                paid_total DECIMAL(14, 2) NOT NULL DEFAULT 0,
+                sale_count INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (period_type, period)
+            )
+        """),
+        ('table', 'payment_rollup', """
+            CREATE TABLE IF NOT EXISTS payment_rollup (
+                period_type VARCHAR(5),
+                period VARCHAR(10),
+                method VARCHAR(50),
+                amount DECIMAL(14, 2) NOT NULL DEFAULT 0,
+                payment_count INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (period_type, period, method)
+            )
+        """),
+        ('table', 'product_rollup', """
+            CREATE TABLE IF NOT EXISTS product_rollup (
+                product_name VARCHAR(255) PRIMARY KEY,
+                qty INT NOT NULL DEFAULT 0,
+                INDEX idx_product_rollup_qty (qty)
+            )
+        """),
+        ('call', rebuild_rollups),
+    ]),
+    (3, "stock reservations for multi-till checkout", [
+        ('column', 'products', 'reserved', "INT NOT NULL DEFAULT 0"),
+        ('table', 'stock_reservations', """
+            CREATE TABLE IF NOT EXISTS stock_reservations (
+                terminal_id VARCHAR(64),
+                product_id INT,
+                qty INT NOT NULL,
+                expires_at DATETIME NOT NULL,
+                PRIMARY KEY (terminal_id, product_id),
+                INDEX idx_reservations_expiry (expires_at)
+            )
+        """),
+    ]),
+    (4, "index for paging the product browser by category and name", [
+        ('call', fill_blank_categories),
+        ('index', 'products', 'idx_products_category_name', ['category', 'name']),
+    ]),
+    (5, "index for paging and searching the customer directory by name", [
+        ('index', 'customers', 'idx_customers_name', ['name']),
+    ]),
+    (6, "product names are unique so saving a product updates it", [
+        ('call', dedupe_product_names),
+        ('unique', 'products', 'uq_products_name', ['name']),
+        # older databases still carry the plain name index an earlier version 1 made
+        ('drop_index', 'products', 'idx_products_name'),
+    ]),
+    (7, "barcodes for scanner lookups", [
+        ('column', 'products', 'barcode', "VARCHAR(64) NULL"),
+        ('unique', 'products', 'uq_products_barcode', ['barcode']),
+    ]),
+    (8, "client generated sale ids so journaled sales replay exactly once", [
+        ('column', 'sales', 'client_id', "CHAR(36) NULL"),
+        ('unique', 'sales', 'uq_sales_client_id', ['client_id']),
+    ]),
+]
+
+# seconds an ALTER may wait for a table's metadata lock before giving up,
+# so a migration never queues live checkouts up behind it
+MIGRATION_LOCK_WAIT = 5
+
+def _index_exists(c, table, name, columns=None, unique=False):
+    # same name, or any index that already leads with these columns (eg. a foreign key's),
+    # only unique ones count when a unique index is wanted
+    existing = {}
+    for idx, col, non_unique in storage.index_columns(c, table):
+        if unique and non_unique: continue
+        existing.setdefault(idx, []).append(col)
+    if name in existing: return True
+    return columns is not None and any(cols[:len(columns)] == columns for cols in existing.values())
+
+def apply_schema_op(conn, c, op):
+    kind = op[0]
+    if kind in ('index', 'unique'):
+        _, table, name, columns = op
+        if _index_exists(c, table, name, columns, unique=(kind == 'unique')): return
+        storage.add_index(c, table, name, columns, unique=(kind == 'unique'))
+    elif kind == 'drop_index':
+        _, table, name = op
+        if not _index_exists(c, table, name): return
+        storage.drop_index(c, table, name)
+    elif kind == 'column':
+        _, table, name, definition = op
+        if storage.has_column(c, table, name): return
+        storage.add_column(c, table, name, definition)
+    elif kind == 'table':
+        for statement in storage.ddl(op[2]): c.execute(statement)
+    elif kind == 'call':
+        op[1](conn)
+
+def migrate(conn):
     c = conn.cursor()
-    
-    # users table
     c.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            description VARCHAR(255),
+            applied_at DATETIME
+        )
+    """)
+    with storage.migration_lock(c, MIGRATION_LOCK_WAIT):
+        c.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        current = c.fetchone()[0]
+        for version, description, ops in MIGRATIONS:
+            if version <= current: continue
+            # ddl commits implicitly, each op checks first so a half-done version can rerun
+            for op in ops:
+                apply_schema_op(conn, c, op)
+            c.execute("INSERT INTO schema_version (version, description, applied_at) VALUES (%s, %s, NOW())", (version, description))
+            conn.commit()
+
+# base tables, everything added since lives in MIGRATIONS
+BASE_TABLES = [
+    # users table
+    """
         CREATE TABLE IF NOT EXISTS users (
             id INT AUTO_INCREMENT PRIMARY KEY, 
             username VARCHAR(255) UNIQUE, 
             password VARCHAR(255), 
             role VARCHAR(50)
         )
-    """)
+    """,
     # products table
-    c.execute("""
+    """
         CREATE TABLE IF NOT EXISTS products (
             id INT AUTO_INCREMENT PRIMARY KEY, 
             name VARCHAR(255), 
@@ -86,18 +1122,18 @@ def init_db():
             price DECIMAL(10, 2), 
             stock INT
         )
-    """)
+    """,
     # customers list
-    c.execute("""
+    """
         CREATE TABLE IF NOT EXISTS customers (
             id INT AUTO_INCREMENT PRIMARY KEY, 
             name VARCHAR(255), 
             phone VARCHAR(50), 
             email VARCHAR(255)
         )
-    """)
+    """,
     # sales history
-    c.execute("""
+    """
         CREATE TABLE IF NOT EXISTS sales (
             id INT AUTO_INCREMENT PRIMARY KEY, 
             date DATETIME, 
@@ -105,9 +1141,9 @@ def init_db():
             customer_id INT, 
             qr_data TEXT
         )
-    """)
+    """,
     # items inside a sale
-    c.execute("""
+    """
         CREATE TABLE IF NOT EXISTS sales_items (
             id INT AUTO_INCREMENT PRIMARY KEY, 
             sale_id INT, 
@@ -117,9 +1153,9 @@ def init_db():
             price DECIMAL(10, 2),
             FOREIGN KEY (sale_id) REFERENCES sales(id) ON DELETE CASCADE
         )
-    """)
+    """,
     # payment records
-    c.execute("""
+    """
         CREATE TABLE IF NOT EXISTS payments (
             id INT AUTO_INCREMENT PRIMARY KEY, 
             sale_id INT, 
@@ -129,85 +1165,763 @@ def init_db():
             timestamp DATETIME, 
             FOREIGN KEY (sale_id) REFERENCES sales(id) ON DELETE CASCADE
         )
-    """)
-    
-    # add admin if empty
-    c.execute("SELECT count(*) FROM users")
-    if c.fetchone()[0] == 0:
-        c.execute("INSERT INTO users (username, password, role) VALUES (%s, %s, %s)", ('admin', '132009', 'admin'))
-        
-        # dummy data for testing
-        items = [
-            ('iPhone 15', 'Electronics', 79900, 20), ('MacBook Air M3', 'Electronics', 114900, 10), 
-            ('iPad Pro 11"', 'Electronics', 81900, 15), ('Apple Watch Series 9', 'Electronics', 41900, 25),
-            ('Sony WH-1000XM5', 'Electronics', 29990, 30), ('Samsung S24 Ultra', 'Electronics', 129999, 12),
-            ('Coca Cola 500ml', 'Beverages', 40, 200), ('Pepsi 500ml', 'Beverages', 40, 180),
-            ('Red Bull', 'Beverages', 125, 100), ('Monster Energy', 'Beverages', 110, 80),
-            ('Bisleri Water 1L', 'Beverages', 20, 500), ('Tropicana Orange', 'Beverages', 110, 60),
-            ('Real Apple Juice', 'Beverages', 120, 60), ('Lipton Ice Tea', 'Beverages', 55, 90),
-            ('Lays Classic Salted', 'Snacks', 20, 200), ('Doritos Cheese', 'Snacks', 30, 150),
-            ('Pringles Original', 'Snacks', 110, 80), ('Kurkure Masala', 'Snacks', 20, 180),
-            ('Maggi 2-Minute', 'Snacks', 14, 300), ('Oreo Biscuits', 'Snacks', 35, 120),
-            ('Dark Fantasy', 'Snacks', 40, 100), ('Haldiram Bhujia', 'Snacks', 55, 90),
-            ('Snickers Bar', 'Snacks', 50, 200), ('KitKat 4-Finger', 'Snacks', 30, 220),
-            ('Tata Salt 1kg', 'Grocery', 28, 100), ('Aashirvaad Atta 5kg', 'Grocery', 240, 50),
-            ('Fortune Oil 1L', 'Grocery', 145, 60), ('India Gate Basmati', 'Grocery', 650, 40),
-            ('Tur Dal 1kg', 'Grocery', 160, 45), ('Sugar 1kg', 'Grocery', 48, 80),
-            ('Taj Mahal Tea 250g', 'Grocery', 180, 55), ('Nescafe Classic', 'Grocery', 220, 50),
-            ('Dove Soap 3-Pack', 'Personal Care', 140, 60), ('Nivea Body Lotion', 'Personal Care', 250, 40),
-            ('Colgate MaxFresh', 'Personal Care', 90, 80), ('Oral-B Toothbrush', 'Personal Care', 40, 100),
-            ('Loreal Shampoo', 'Personal Care', 320, 35), ('Gillette Mach3', 'Personal Care', 350, 45),
-            ('Old Spice Deodorant', 'Personal Care', 220, 50), ('Dettol Handwash', 'Personal Care', 75, 70),
-            ('Classmate Notebook', 'Stationery', 60, 150), ('Pilot V5 Pen', 'Stationery', 50, 200),
-            ('Parker Vector Pen', 'Stationery', 350, 30), ('Camlin Pencils 10s', 'Stationery', 40, 120),
-            ('Fevicol 100g', 'Stationery', 35, 100), ('Scotch Tape', 'Stationery', 45, 80),
-            ('Surf Excel 1kg', 'Household', 160, 60), ('Vim Dish Bar', 'Household', 30, 150),
-            ('Lizol Floor Cleaner', 'Household', 180, 40), ('Harpic Cleaner', 'Household', 95, 55),
-            ('Duracell AA 4x', 'Household', 140, 80), ('Odonil Air Freshener', 'Household', 65, 70),
-            ('Scotch Brite', 'Household', 25, 120), ('Garbage Bags', 'Household', 90, 65)
-        ] * 3 
-        
-        unique_items = []
-        for i, item in enumerate(items):
-            suffix = "" if i < 60 else (f" (V{i//60})")
-            unique_items.append((item[0] + suffix, item[1], item[2], item[3]))
-        
-        c.executemany("INSERT INTO products (name, category, price, stock) VALUES (%s, %s, %s, %s)", unique_items)
+    """,
+    # what schema this database was last brought up to
+    """
+        CREATE TABLE IF NOT EXISTS schema_meta (
+            name VARCHAR(50) PRIMARY KEY,
+            value VARCHAR(255)
+        )
+    """,
+]
 
-        # random names for demo customers
-        f_names = ["Aarav", "Arjun", "Aditya", "Vihaan", "Rohan", "Rahul", "Vikram", "Suresh", "Riya", "Diya", "Ananya", "Ishita", "Kavya", "Priya", "Pooja", "Neha", "Sneha", "Amit", "Manish", "Raj", "Kartik", "Sanjay", "Deepak", "Anil", "Meera", "Sunita", "Anita"]
-        l_names = ["Sharma", "Verma", "Gupta", "Singh", "Patel", "Kumar", "Yadav", "Mishra", "Reddy", "Jain", "Mehta", "Malhotra", "Saxena", "Chopra", "Deshmukh", "Nair", "Iyer", "Rao", "Gowda", "Bhat"]
-        
-        for i in range(45):
-            fn = random.choice(f_names)
-            ln = random.choice(l_names)
-            phone = f"+91 {random.randint(6000, 9999)} {random.randint(10000, 99999)}"
-            email = f"{fn.lower()}.{ln.lower()}@gmail.com"
-            c.execute("INSERT INTO customers (name, phone, email) VALUES (%s, %s, %s)", (f"{fn} {ln}", phone, email))
+# hash of the base tables and every migration, stored once the schema is up to date
+def schema_fingerprint():
+    h = hashlib.sha256()
+    for ddl in BASE_TABLES:
+        h.update(ddl.encode())
+    for version, description, ops in MIGRATIONS:
+        h.update(f"{version} {description}".encode())
+        for op in ops:
+            # backfill functions by name, their repr changes every run
+            h.update(repr([getattr(part, '__name__', part) for part in op]).encode())
+    return h.hexdigest()[:32]
 
-    conn.commit()
-    conn.close()
+SCHEMA_FINGERPRINT = schema_fingerprint()
 
-# flask app to serve bills
-app_server = Flask(__name__)
+def schema_is_current():
+    # one query on a pooled connection instead of the DDL when nothing changed
+    try:
+        with db_connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT value FROM schema_meta WHERE name = 'fingerprint'")
+            row = c.fetchone()
+    except storage.Error:
+        # no database or no schema_meta yet
+        return False
+    return row is not None and row[0] == SCHEMA_FINGERPRINT
+
+# demo catalog and names, used for the first-run seed and by generate_data
+DEMO_PRODUCTS = [
+    ('iPhone 15', 'Electronics', 79900, 20), ('MacBook Air M3', 'Electronics', 114900, 10), 
+    ('iPad Pro 11"', 'Electronics', 81900, 15), ('Apple Watch Series 9', 'Electronics', 41900, 25),
+    ('Sony WH-1000XM5', 'Electronics', 29990, 30), ('Samsung S24 Ultra', 'Electronics', 129999, 12),
+    ('Coca Cola 500ml', 'Beverages', 40, 200), ('Pepsi 500ml', 'Beverages', 40, 180),
+    ('Red Bull', 'Beverages', 125, 100), ('Monster Energy', 'Beverages', 110, 80),
+    ('Bisleri Water 1L', 'Beverages', 20, 500), ('Tropicana Orange', 'Beverages', 110, 60),
+    ('Real Apple Juice', 'Beverages', 120, 60), ('Lipton Ice Tea', 'Beverages', 55, 90),
+    ('Lays Classic Salted', 'Snacks', 20, 200), ('Doritos Cheese', 'Snacks', 30, 150),
+    ('Pringles Original', 'Snacks', 110, 80), ('Kurkure Masala', 'Snacks', 20, 180),
+    ('Maggi 2-Minute', 'Snacks', 14, 300), ('Oreo Biscuits', 'Snacks', 35, 120),
+    ('Dark Fantasy', 'Snacks', 40, 100), ('Haldiram Bhujia', 'Snacks', 55, 90),
+    ('Snickers Bar', 'Snacks', 50, 200), ('KitKat 4-Finger', 'Snacks', 30, 220),
+    ('Tata Salt 1kg', 'Grocery', 28, 100), ('Aashirvaad Atta 5kg', 'Grocery', 240, 50),
+    ('Fortune Oil 1L', 'Grocery', 145, 60), ('India Gate Basmati', 'Grocery', 650, 40),
+    ('Tur Dal 1kg', 'Grocery', 160, 45), ('Sugar 1kg', 'Grocery', 48, 80),
+    ('Taj Mahal Tea 250g', 'Grocery', 180, 55), ('Nescafe Classic', 'Grocery', 220, 50),
+    ('Dove Soap 3-Pack', 'Personal Care', 140, 60), ('Nivea Body Lotion', 'Personal Care', 250, 40),
+    ('Colgate MaxFresh', 'Personal Care', 90, 80), ('Oral-B Toothbrush', 'Personal Care', 40, 100),
+    ('Loreal Shampoo', 'Personal Care', 320, 35), ('Gillette Mach3', 'Personal Care', 350, 45),
+    ('Old Spice Deodorant', 'Personal Care', 220, 50), ('Dettol Handwash', 'Personal Care', 75, 70),
+    ('Classmate Notebook', 'Stationery', 60, 150), ('Pilot V5 Pen', 'Stationery', 50, 200),
+    ('Parker Vector Pen', 'Stationery', 350, 30), ('Camlin Pencils 10s', 'Stationery', 40, 120),
+    ('Fevicol 100g', 'Stationery', 35, 100), ('Scotch Tape', 'Stationery', 45, 80),
+    ('Surf Excel 1kg', 'Household', 160, 60), ('Vim Dish Bar', 'Household', 30, 150),
+    ('Lizol Floor Cleaner', 'Household', 180, 40), ('Harpic Cleaner', 'Household', 95, 55),
+    ('Duracell AA 4x', 'Household', 140, 80), ('Odonil Air Freshener', 'Household', 65, 70),
+    ('Scotch Brite', 'Household', 25, 120), ('Garbage Bags', 'Household', 90, 65)
+]
+DEMO_FIRST_NAMES = ["Aarav", "Arjun", "Aditya", "Vihaan", "Rohan", "Rahul", "Vikram", "Suresh", "Riya", "Diya", "Ananya", "Ishita", "Kavya", "Priya", "Pooja", "Neha", "Sneha", "Amit", "Manish", "Raj", "Kartik", "Sanjay", "Deepak", "Anil", "Meera", "Sunita", "Anita"]
+DEMO_LAST_NAMES = ["Sharma", "Verma", "Gupta", "Singh", "Patel", "Kumar", "Yadav", "Mishra", "Reddy", "Jain", "Mehta", "Malhotra", "Saxena", "Chopra", "Deshmukh", "Nair", "Iyer", "Rao", "Gowda", "Bhat"]
+
+def demo_customer(rng):
+    fn = rng.choice(DEMO_FIRST_NAMES)
+    ln = rng.choice(DEMO_LAST_NAMES)
+    phone = f"+91 {rng.randint(6000, 9999)} {rng.randint(10000, 99999)}"
+    email = f"{fn.lower()}.{ln.lower()}@gmail.com"
+    return (f"{fn} {ln}", phone, email)
+
+def init_db():
+    # launches after the first only check the fingerprint
+    if schema_is_current(): return
 
-@app_server.route('/bill/<int:sale_id>')
-def serve_bill(sale_id):
     try:
-        conn = get_db_connection()
+        storage.create_database()
+    except (storage.Error, OSError) as err:
+        print(f"Error creating database: {err}")
+        return
+
+    # connect to actual db and make tables
+    with db_connection() as conn:
         c = conn.cursor()
-        # fetch sale info
-        c.execute("SELECT date, total FROM sales WHERE id=%s", (sale_id,))
-        sale = c.fetchone()
-        if not sale: return "<h1>Receipt Not Found</h1>"
-        
-        # fetch items in sale
-        c.execute("SELECT product_name, qty, price FROM sales_items WHERE sale_id=%s", (sale_id,))
-        items = c.fetchall()
-        conn.close()
+        for ddl in BASE_TABLES:
+            for statement in storage.ddl(ddl): c.execute(statement)
+    
+        # add admin if empty
+        c.execute("SELECT count(*) FROM users")
+        if c.fetchone()[0] == 0:
+            c.execute("INSERT INTO users (username, password, role) VALUES (%s, %s, %s)", ('admin', '132009', 'admin'))
         
-        # build html receipt
-        html = f"""
+            # dummy data for testing, three copies of the catalog
+            unique_items = []
+            n = len(DEMO_PRODUCTS)
+            for i, item in enumerate(DEMO_PRODUCTS * 3):
+                suffix = "" if i < n else (f" (V{i//n})")
+                unique_items.append((item[0] + suffix, item[1], item[2], item[3]))
+            insert_rows(c, 'products', ('name', 'category', 'price', 'stock'), unique_items)
+
+            # random names for demo customers
+            insert_rows(c, 'customers', ('name', 'phone', 'email'), [demo_customer(random) for i in range(45)])
+
+        conn.commit()
+        migrate(conn)
+        c.execute("""INSERT INTO schema_meta (name, value) VALUES ('fingerprint', %s)
+                     ON DUPLICATE KEY UPDATE value = VALUES(value)""", (SCHEMA_FINGERPRINT,))
+        conn.commit()
+
+# catalog index settings
+CATALOG_CONFIG = {
+    'refresh_interval': 60
+}
+
+# in-memory product index so lookups never scan products with LIKE
+class CatalogIndex:
+    def __init__(self):
+        self.products = {}
+        self.loaded = False
+        self._lower = {}
+        self._by_name = {}
+        self._by_barcode = {}
+        self._names = []
+        self._tokens = []
+        self._trigrams = {}
+        self._max_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _grams(text):
+        return {text[i:i+3] for i in range(len(text) - 2)}
+
+    @staticmethod
+    def _words(text):
+        # punctuation splits words too, "(v1)" and "500ml," index as "v1" and "500ml"
+        return re.findall(r'\w+', text)
+
+    def _add(self, row):
+        # rows are (id, name, category, price, stock, barcode)
+        pid, name = row[0], row[1]
+        low = name.lower()
+        self.products[pid] = row
+        self._lower[pid] = low
+        self._by_name.setdefault(low, pid)
+        if row[5]: self._by_barcode[row[5]] = pid
+        bisect.insort(self._names, (low, pid))
+        for tok in set(self._words(low)):
+            bisect.insort(self._tokens, (tok, pid))
+        for g in self._grams(low):
+            self._trigrams.setdefault(g, set()).add(pid)
+        self._max_id = max(self._max_id, pid)
+
+    def _remove(self, pid):
+        low = self._lower.pop(pid)
+        code = self.products.pop(pid)[5]
+        if self._by_name.get(low) == pid: del self._by_name[low]
+        if code and self._by_barcode.get(code) == pid: del self._by_barcode[code]
+        self._names.remove((low, pid))
+        for tok in set(self._words(low)):
+            self._tokens.remove((tok, pid))
+        for g in self._grams(low):
+            self._trigrams[g].discard(pid)
+
+    def load(self, conn):
+        c = conn.cursor()
+        c.execute("SELECT id, name, category, price, stock, barcode FROM products")
+        fresh = CatalogIndex()
+        # build without holding the lock, sort once at the end instead of insort per row
+        for row in c.fetchall():
+            pid, low = row[0], row[1].lower()
+            fresh.products[pid] = row
+            fresh._lower[pid] = low
+            fresh._by_name.setdefault(low, pid)
+            if row[5]: fresh._by_barcode[row[5]] = pid
+            fresh._names.append((low, pid))
+            fresh._tokens.extend((tok, pid) for tok in set(fresh._words(low)))
+            for g in fresh._grams(low):
+                fresh._trigrams.setdefault(g, set()).add(pid)
+            fresh._max_id = max(fresh._max_id, pid)
+        fresh._names.sort()
+        fresh._tokens.sort()
+        with self._lock:
+            self.products, self._lower, self._by_name = fresh.products, fresh._lower, fresh._by_name
+            self._by_barcode = fresh._by_barcode
+            self._names, self._tokens, self._trigrams = fresh._names, fresh._tokens, fresh._trigrams
+            self._max_id = fresh._max_id
+            self.loaded = True
+
+    def refresh(self, conn):
+        # pick up products added since the last load
+        if not self.loaded: return self.load(conn)
+        c = conn.cursor()
+        c.execute("SELECT id, name, category, price, stock, barcode FROM products WHERE id > %s", (self._max_id,))
+        rows = c.fetchall()
+        with self._lock:
+            for row in rows: self._add(row)
+
+    def put(self, row):
+        # insert or replace a single product, e.g. right after saving it
+        with self._lock:
+            if row[0] in self.products: self._remove(row[0])
+            self._add(row)
+
+    def _span(self, table, q):
+        # slice of a sorted (key, id) table whose keys start with q
+        return bisect.bisect_left(table, (q,)), bisect.bisect_left(table, (q + '\uffff',))
+
+    def _substring(self, q):
+        sets = [self._trigrams.get(g) for g in self._grams(q)]
+        if not sets or not all(sets): return []
+        sets.sort(key=len)
+        hits = set(sets[0])
+        for other in sets[1:]:
+            hits &= other
+            if not hits: return []
+        return [pid for pid in hits if q in self._lower[pid]]
+
+    def search(self, query, limit=5):
+        # rank: exact name, name prefix, word prefixes, then any substring
+        # a weaker stage only runs when the stronger ones came up short, and very
+        # common prefixes are capped so ranking inside them is only approximate
+        q = query.lower().strip()
+        if not q: return []
+        ranked = {}
+        with self._lock:
+            pid = self._by_name.get(q)
+            if pid is not None: ranked[pid] = 0
+            lo, hi = self._span(self._names, q)
+            for _, pid in self._names[lo:min(hi, lo + limit * 50)]: ranked.setdefault(pid, 1)
+
+            words = self._words(q)
+            if len(ranked) < limit and words:
+                # walk the rarest word, check the others against the name itself
+                spans = sorted((self._span(self._tokens, w) for w in words), key=lambda sp: sp[1] - sp[0])
+                lo, hi = spans[0]
+                for _, pid in self._tokens[lo:min(hi, lo + limit * 50)]:
+                    toks = self._words(self._lower[pid])
+                    if all(any(t.startswith(w) for t in toks) for w in words):
+                        ranked.setdefault(pid, 2)
+
+            if len(ranked) < limit and len(q) >= 3:
+                for pid in self._substring(q): ranked.setdefault(pid, 3)
+
+            hits = heapq.nsmallest(limit, ranked, key=lambda pid: (ranked[pid], len(self._lower[pid]), self._lower[pid]))
+            return [self.products[pid] for pid in hits]
+
+    def by_barcode(self, code):
+        # exact scan lookup, one dict hit
+        with self._lock:
+            pid = self._by_barcode.get(code)
+            return self.products[pid] if pid is not None else None
+
+    def resolve(self, query):
+        # a typed barcode wins over any name match
+        row = self.by_barcode(query.strip())
+        if row is not None: return row
+        hits = self.search(query, 1)
+        return hits[0] if hits else None
+
+catalog = CatalogIndex()
+
+# money is Decimal rupees rounded to the paisa, never float
+PAISA = Decimal('0.01')
+TAX_RATE = Decimal('0')
+
+def to_money(value):
+    return Decimal(str(value)).quantize(PAISA, rounding=ROUND_HALF_UP)
+
+class CartLine:
+    __slots__ = ('product_id', 'name', 'price', 'qty')
+
+    def __init__(self, product_id, name, price, qty):
+        self.product_id = product_id
+        self.name = name
+        self.price = price
+        self.qty = qty
+
+    @property
+    def amount(self):
+        return self.price * self.qty
+
+# basket keyed by product id, subtotal kept up to date so every change is O(1)
+class Cart:
+    def __init__(self, tax_rate=TAX_RATE):
+        self.lines = {}
+        self.subtotal = Decimal('0.00')
+        self.tax_rate = tax_rate
+        self.discount_rate = Decimal('0')
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __iter__(self):
+        return iter(self.lines.values())
+
+    def add(self, product_id, name, price, qty):
+        # returns (line, is_new) so the view can update just that row
+        line = self.lines.get(product_id)
+        is_new = line is None
+        if is_new:
+            line = self.lines[product_id] = CartLine(product_id, name, to_money(price), 0)
+        line.qty += qty
+        self.subtotal += line.price * qty
+        return line, is_new
+
+    def set_qty(self, product_id, qty):
+        line = self.lines[product_id]
+        self.subtotal += line.price * (qty - line.qty)
+        line.qty = qty
+        return line
+
+    def remove(self, product_id):
+        line = self.lines.pop(product_id, None)
+        if line is not None:
+            self.subtotal -= line.amount
+        return line
+
+    def clear(self):
+        self.lines.clear()
+        self.subtotal = Decimal('0.00')
+        self.discount_rate = Decimal('0')
+
+    @property
+    def discount(self):
+        return (self.subtotal * self.discount_rate).quantize(PAISA, rounding=ROUND_HALF_UP)
+
+    @property
+    def tax(self):
+        return ((self.subtotal - self.discount) * self.tax_rate).quantize(PAISA, rounding=ROUND_HALF_UP)
+
+    @property
+    def total(self):
+        return self.subtotal - self.discount + self.tax
+
+    def as_items(self):
+        # plain dicts for record_sale and the receipt
+        return [{'id': l.product_id, 'name': l.name, 'price': l.price, 'qty': l.qty} for l in self.lines.values()]
+
+# receipts are served by the embedded flask app, the url only depends on the id the
+# till gave the sale, so the qr code is ready before mysql has seen it
+RECEIPT_BASE_URL = "http://localhost:8000"
+
+def receipt_url(client_id):
+    return f"{RECEIPT_BASE_URL}/r/{client_id}"
+
+# deadlock and lock wait timeout, both safe to retry from the top
+RETRYABLE_ERRORS = (1213, 1205)
+CHECKOUT_RETRIES = 3
+
+# run fn(cursor) as one explicit transaction, retrying it when mysql picks it as a deadlock victim
+def run_transaction(conn, fn, retries=CHECKOUT_RETRIES):
+    for attempt in range(retries + 1):
+        try:
+            conn.start_transaction()
+            result = fn(conn.cursor())
+            conn.commit()
+            return result
+        except Exception as err:
+            conn.rollback()
+            if getattr(err, 'errno', None) not in RETRYABLE_ERRORS or attempt == retries: raise
+            time.sleep(0.05 * (attempt + 1))
+
+@query_metrics.skip
+def insert_rows(c, table, columns, rows, update=()):
+    # one multi-row INSERT instead of a round trip per row, rows that hit a unique
+    # key get the 'update' columns overwritten instead. an update entry can also be
+    # a (column, expression) pair, e.g. to keep the old value when the new one is NULL
+    marks = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES " + ", ".join([marks] * len(rows))
+    sets = [col if isinstance(col, tuple) else (col, f"VALUES({col})") for col in update]
+    if sets: sql += " ON DUPLICATE KEY UPDATE " + ", ".join(f"{col} = {expr}" for col, expr in sets)
+    c.execute(sql, [v for row in rows for v in row])
+
+# stock reservation settings, each till holds what is in its cart until the ttl runs out
+RESERVATION_CONFIG = {
+    'terminal_id': socket.gethostname(),
+    'ttl': 900,
+    'sweep_interval': 60
+}
+
+class OutOfStock(Exception):
+    def __init__(self, product_id, available):
+        super().__init__(f"only {available} left")
+        self.product_id = product_id
+        self.available = available
+
+# every path below locks reservation rows first and product rows second, always
+# in ascending id order, so tills contending for the same items cannot deadlock
+
+def _id_list(ids):
+    return ', '.join(['%s'] * len(ids))
+
+def _case(values, column='id'):
+    # CASE id WHEN .. THEN .. END over a {id: value} dict, ids sorted
+    ids = sorted(values)
+    return f"CASE {column} {' '.join(['WHEN %s THEN %s'] * len(ids))} ELSE 0 END", [v for pid in ids for v in (pid, values[pid])]
+
+def _release_held(c, held):
+    if not held: return
+    ids = sorted(held)
+    case, params = _case(held)
+    c.execute(f"UPDATE products SET reserved = GREATEST(reserved - {case}, 0) WHERE id IN ({_id_list(ids)})", params + ids)
+
+def reserve_stock(c, product_id, qty):
+    terminal = RESERVATION_CONFIG['terminal_id']
+    # the till's clock, same as sweep_reservations compares against
+    expires = (datetime.datetime.now() + datetime.timedelta(seconds=RESERVATION_CONFIG['ttl'])).strftime("%Y-%m-%d %H:%M:%S")
+    c.execute("""INSERT INTO stock_reservations (terminal_id, product_id, qty, expires_at)
+                 VALUES (%s, %s, %s, %s)
+                 ON DUPLICATE KEY UPDATE qty = qty + VALUES(qty)""", (terminal, product_id, qty, expires))
+    # any activity on the basket keeps the whole basket held. done before the product
+    # row is touched, reservations are always locked first
+    c.execute("UPDATE stock_reservations SET expires_at = %s WHERE terminal_id = %s", (expires, terminal))
+    # conditional bump, fails fast instead of queueing behind the other tills
+    c.execute("UPDATE products SET reserved = reserved + %s WHERE id = %s AND stock - reserved >= %s", (qty, product_id, qty))
+    if c.rowcount == 0:
+        c.execute("SELECT stock - reserved FROM products WHERE id = %s", (product_id,))
+        row = c.fetchone()
+        raise OutOfStock(product_id, max(row[0], 0) if row else 0)
+    # the row as it is now, locked by the bump above, so the cart bills today's price
+    # even when another till edited the product since the catalog index last loaded it
+    c.execute("SELECT id, name, category, price, stock, barcode FROM products WHERE id = %s", (product_id,))
+    return c.fetchone()
+
+def release_reservations(c, product_ids=None):
+    # give back this till's holds, all of them or just some products
+    terminal = RESERVATION_CONFIG['terminal_id']
+    where, params = "terminal_id = %s", [terminal]
+    if product_ids:
+        where += f" AND product_id IN ({_id_list(product_ids)})"
+        params += list(product_ids)
+    c.execute(f"SELECT product_id, qty FROM stock_reservations WHERE {where} ORDER BY product_id FOR UPDATE", params)
+    held = dict(c.fetchall())
+    _release_held(c, held)
+    c.execute(f"DELETE FROM stock_reservations WHERE {where}", params)
+
+def sweep_reservations(c):
+    # hand back stock held by baskets that were abandoned on any till
+    cutoff = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    c.execute("SELECT product_id, qty FROM stock_reservations WHERE expires_at < %s ORDER BY terminal_id, product_id FOR UPDATE", (cutoff,))
+    held = {}
+    for pid, qty in c.fetchall():
+        held[pid] = held.get(pid, 0) + qty
+    _release_held(c, held)
+    c.execute("DELETE FROM stock_reservations WHERE expires_at < %s", (cutoff,))
+
+def commit_stock(c, qty_by_id, strict=True):
+    # turn this till's holds into a real decrement, failing the sale instead of overselling.
+    # a replayed sale has already left the shop, with strict off it is taken off whatever is there
+    terminal = RESERVATION_CONFIG['terminal_id']
+    ids = sorted(qty_by_id)
+    c.execute(f"""SELECT product_id, qty FROM stock_reservations WHERE terminal_id = %s AND product_id IN ({_id_list(ids)})
+                  ORDER BY product_id FOR UPDATE""", [terminal] + ids)
+    # only what this sale sold comes off the holds, the next basket may already hold more of the same
+    held = {pid: min(qty, qty_by_id[pid]) for pid, qty in c.fetchall()}
+    qty_case, qty_params = _case(qty_by_id)
+    held_case, held_params = _case(held) if held else ("0", [])
+    where, params = f"id IN ({_id_list(ids)})", ids
+    if strict:
+        where += f" AND stock - reserved + {held_case} >= {qty_case}"
+        params = ids + held_params + qty_params
+    c.execute(f"UPDATE products SET stock = stock - {qty_case}, reserved = GREATEST(reserved - {held_case}, 0) WHERE {where}",
+              qty_params + held_params + params)
+    if strict and c.rowcount < len(ids):
+        c.execute(f"SELECT id, stock - reserved FROM products WHERE id IN ({_id_list(ids)}) ORDER BY id", ids)
+        for pid, available in c.fetchall():
+            if available + held.get(pid, 0) < qty_by_id[pid]:
+                raise OutOfStock(pid, max(available + held.get(pid, 0), 0))
+        raise OutOfStock(ids[0], 0)
+    if not held: return
+    held_ids = sorted(held)
+    hold_case, hold_params = _case(held, 'product_id')
+    c.execute(f"UPDATE stock_reservations SET qty = qty - {hold_case} WHERE terminal_id = %s AND product_id IN ({_id_list(held_ids)})",
+              hold_params + [terminal] + held_ids)
+    c.execute(f"DELETE FROM stock_reservations WHERE terminal_id = %s AND product_id IN ({_id_list(held_ids)}) AND qty <= 0",
+              [terminal] + held_ids)
+
+# write a whole sale: header, items, stock, payments and rollups. a client_id mysql
+# already has means the sale was written before, its id comes back and nothing is redone
+def record_sale(c, now, total, discount, customer_id, items, payments, client_id=None, strict=True):
+    if client_id:
+        c.execute("SELECT id FROM sales WHERE client_id = %s FOR UPDATE", (client_id,))
+        row = c.fetchone()
+        if row: return row[0]
+    dt = now.strftime("%Y-%m-%d %H:%M:%S")
+    c.execute("INSERT INTO sales (date, total, discount, customer_id, client_id) VALUES (%s,%s,%s,%s,%s)",
+              (dt, total, discount, customer_id, client_id))
+    sale_id = c.lastrowid
+
+    insert_rows(c, 'sales_items', ('sale_id', 'product_id', 'product_name', 'qty', 'price'),
+                [(sale_id, item['id'], item['name'], int(item['qty']), item['price']) for item in items])
+
+    # single set-based decrement that also consumes this till's reservations
+    qty_by_id = {}
+    for item in items:
+        qty_by_id[item['id']] = qty_by_id.get(item['id'], 0) + int(item['qty'])
+    commit_stock(c, qty_by_id, strict)
+
+    insert_rows(c, 'payments', ('sale_id', 'method', 'amount', 'timestamp'),
+                [(sale_id, method, amount, dt) for method, amount in payments])
+
+    # keep dashboard totals current in the same transaction
+    bump_rollups(c, now, total, discount, items, payments)
+    return sale_id
+
+# local sales journal settings. checkout commits here and a worker replays to mysql, so a
+# sale never waits on the network. 'path' None writes straight to the database instead,
+# which is already local with the sqlite backend
+SALES_JOURNAL_CONFIG = {
+    'path': 'swiftsale_journal.db' if STORAGE_CONFIG['backend'] == 'mysql' else None,
+    'group_window': 0.005,
+    'batch': 50,
+    'sync_interval': 2,
+    'max_attempts': 5,
+    'keep_days': 7
+}
+
+def sale_payload(now, total, discount, customer_id, items, payments):
+    # json safe, Decimals travel as strings so no paisa is lost
+    return {'date': now.strftime("%Y-%m-%d %H:%M:%S"), 'total': str(total), 'discount': str(discount),
+            'customer_id': customer_id,
+            'items': [{'id': i['id'], 'name': i['name'], 'price': str(i['price']), 'qty': int(i['qty'])} for i in items],
+            'payments': [[method, str(amount)] for method, amount in payments]}
+
+def replay_sale(c, client_id, sale):
+    items = [dict(item, price=Decimal(item['price'])) for item in sale['items']]
+    payments = [(method, Decimal(amount)) for method, amount in sale['payments']]
+    now = datetime.datetime.strptime(sale['date'], "%Y-%m-%d %H:%M:%S")
+    return record_sale(c, now, Decimal(sale['total']), Decimal(sale['discount']), sale['customer_id'],
+                       items, payments, client_id=client_id, strict=False)
+
+# append-only sqlite log of finished sales. appends that arrive together share one
+# commit and one fsync, a background worker pushes them to mysql in batches
+class SalesJournal:
+    def __init__(self, path, group_window=0.005, batch=50, sync_interval=2, max_attempts=5, keep_days=7):
+        self.path = path
+        self.group_window = group_window
+        self.batch = batch
+        self.sync_interval = sync_interval
+        self.max_attempts = max_attempts
+        self.keep_days = keep_days
+        self.status = 'stopped'
+        self.backlog = 0
+        self._db = None
+        self._lock = threading.Lock()
+        self._queue = []
+        self._cond = threading.Condition()
+        self._closing = False
+        self._wake = threading.Event()
+        self._writer = None
+
+    def open(self):
+        with self._lock:
+            if self._db is not None: return
+            # shared by the writer, the sync worker and the receipt server, always under _lock
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            # a sale is only reported saved once it is on disk
+            db.execute("PRAGMA synchronous=FULL")
+            db.execute("""CREATE TABLE IF NOT EXISTS journal (
+                              seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                              client_id TEXT NOT NULL UNIQUE,
+                              created TEXT NOT NULL,
+                              sale TEXT NOT NULL,
+                              sale_id INTEGER,
+                              attempts INTEGER NOT NULL DEFAULT 0,
+                              error TEXT)""")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_journal_pending ON journal (sale_id, seq)")
+            cutoff = (datetime.datetime.now() - datetime.timedelta(days=self.keep_days)).strftime("%Y-%m-%d %H:%M:%S")
+            db.execute("DELETE FROM journal WHERE sale_id IS NOT NULL AND created < ?", (cutoff,))
+            self.backlog = db.execute("SELECT COUNT(*) FROM journal WHERE sale_id IS NULL").fetchone()[0]
+            self._db = db
+        self.status = 'syncing' if self.backlog else 'synced'
+        self._writer = threading.Thread(target=self._write_loop, daemon=True, name='swiftsale-journal')
+        self._writer.start()
+        threading.Thread(target=self._sync_loop, daemon=True, name='swiftsale-sync').start()
+
+    def append(self, client_id, sale, done):
+        # done(err) runs on the writer thread once the sale is durable, err None on success
+        try:
+            self.open()
+        except Exception as err:
+            done(err)
+            return
+        with self._cond:
+            self._queue.append(((client_id, sale['date'], json.dumps(sale)), done))
+            self._cond.notify()
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closing:
+                    self._cond.wait()
+                if not self._queue: return
+            # tills checking out in the same few ms join this commit
+            if not self._closing: time.sleep(self.group_window)
+            with self._cond:
+                entries, self._queue = self._queue, []
+            err = None
+            try:
+                with self._lock:
+                    self._db.execute("BEGIN IMMEDIATE")
+                    try:
+                        self._db.executemany("INSERT INTO journal (client_id, created, sale) VALUES (?, ?, ?)",
+                                             [row for row, _ in entries])
+                        self._db.execute("COMMIT")
+                    except BaseException:
+                        self._db.execute("ROLLBACK")
+                        raise
+                    self.backlog += len(entries)
+            except Exception as exc:
+                err = exc
+            for _, done in entries: done(err)
+            if err is None: self._wake.set()
+
+    def _sync_loop(self):
+        schema_ready.wait()
+        while not self._closing:
+            try:
+                while self.sync_batch(): pass
+            except Exception as err:
+                # mysql is away, the sales stay here until the next round
+                self.status = f"offline: {err}"
+            self._wake.wait(self.sync_interval)
+            self._wake.clear()
+
+    def sync_batch(self):
+        # replays up to 'batch' pending sales, returns how many were synced
+        with self._lock:
+            rows = self._db.execute("""SELECT seq, client_id, sale FROM journal WHERE sale_id IS NULL AND attempts < ?
+                                       ORDER BY seq LIMIT ?""", (self.max_attempts, self.batch)).fetchall()
+        if not rows:
+            self.status = 'synced' if not self.backlog else f"{self.backlog} sales need attention"
+            return 0
+        self.status = 'syncing'
+        synced, failed = [], []
+        with db_connection() as conn:
+            try:
+                # the whole batch in one transaction, the usual case
+                ids = run_transaction(conn, lambda c: [replay_sale(c, client_id, json.loads(sale)) for _, client_id, sale in rows])
+                synced = [(sale_id, seq) for sale_id, (seq, _, _) in zip(ids, rows)]
+            except Exception as err:
+                if storage.unreachable(err): raise
+                # something in the batch is bad, one at a time so the rest still get through
+                for seq, client_id, sale in rows:
+                    try:
+                        synced.append((run_transaction(conn, lambda c: replay_sale(c, client_id, json.loads(sale))), seq))
+                    except Exception as one:
+                        if storage.unreachable(one): raise
+                        print(f"Journaled sale {client_id} could not be synced: {one}")
+                        failed.append((str(one), seq))
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.executemany("UPDATE journal SET sale_id = ?, error = NULL WHERE seq = ?", synced)
+            self._db.executemany("UPDATE journal SET attempts = attempts + 1, error = ? WHERE seq = ?", failed)
+            self._db.execute("COMMIT")
+            self.backlog -= len(synced)
+        return len(synced)
+
+    def load_receipt(self, client_id):
+        # (sale, items) like load_receipt, for sales still here or recently synced
+        if self._db is None: return None
+        with self._lock:
+            row = self._db.execute("SELECT sale FROM journal WHERE client_id = ?", (client_id,)).fetchone()
+        if row is None: return None
+        sale = json.loads(row[0])
+        return ((sale['date'], Decimal(sale['total'])),
+                [(item['name'], item['qty'], Decimal(item['price'])) for item in sale['items']])
+
+    def close(self):
+        # flush what is queued, whatever is not in mysql yet goes next launch
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._wake.set()
+        if self._writer is not None: self._writer.join(timeout=5)
+        with self._lock:
+            if self._db is not None: self._db.close()
+            self._db = None
+        self.status = 'stopped'
+
+sales_journal = SalesJournal(**SALES_JOURNAL_CONFIG)
+
+# rendered receipt cache settings, set 'dir' to keep receipts across restarts
+RECEIPT_CACHE_CONFIG = {
+    'size': 512,
+    'dir': None
+}
+
+# a receipt never changes once its sale commits, so rendered pages are kept for good
+class ReceiptCache:
+    def __init__(self, size=512, dir=None):
+        self.size = size
+        self.dir = dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if dir: os.makedirs(dir, exist_ok=True)
+
+    def _path(self, sale_id):
+        return os.path.join(self.dir, f"{sale_id}.html")
+
+    def _store(self, sale_id, body):
+        entry = (body, hashlib.sha256(body).hexdigest()[:32])
+        with self._lock:
+            self._entries[sale_id] = entry
+            self._entries.move_to_end(sale_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def get(self, sale_id):
+        # (body, etag) or None
+        with self._lock:
+            entry = self._entries.get(sale_id)
+            if entry is not None:
+                self._entries.move_to_end(sale_id)
+                return entry
+        if not self.dir: return None
+        try:
+            with open(self._path(sale_id), 'rb') as f:
+                return self._store(sale_id, f.read())
+        except OSError:
+            return None
+
+    def put(self, sale_id, page):
+        body = page.encode('utf-8')
+        if self.dir:
+            # write then rename so a crash never leaves half a receipt on disk
+            tmp = self._path(sale_id) + ".tmp"
+            with open(tmp, 'wb') as f: f.write(body)
+            os.replace(tmp, self._path(sale_id))
+        return self._store(sale_id, body)
+
+receipt_cache = ReceiptCache(**RECEIPT_CACHE_CONFIG)
+
+def load_receipt(conn, sale_id):
+    c = conn.cursor()
+    # fetch sale info
+    c.execute("SELECT date, total FROM sales WHERE id=%s", (sale_id,))
+    sale = c.fetchone()
+    if not sale: return None
+    # fetch items in sale
+    c.execute("SELECT product_name, qty, price FROM sales_items WHERE sale_id=%s", (sale_id,))
+    return sale, c.fetchall()
+
+def receipt_number(client_id):
+    # short enough to read out over the counter
+    return client_id[:8].upper()
+
+def render_receipt(sale_id, sale, items):
+    # build html receipt
+    parts = [f"""
         <!doctype html>
         <html lang="en">
           <head>
@@ -226,28 +1940,180 @@ def serve_bill(sale_id):
             <div class="card">
               <h1>SwiftSale Receipt</h1>
               <div class="meta">{sale[0]} • #{sale_id}</div>
-        """
-        for i in items:
-            html += f'<div class="line"><span>{i[0]} <small>x{i[1]}</small></span> <span>{i[2]*i[1]:.2f}</span></div>'
-        
-        html += f"""
+        """]
+    parts.extend(f'<div class="line"><span>{escape(i[0])} <small>x{i[1]}</small></span> <span>{i[2]*i[1]:.2f}</span></div>' for i in items)
+    parts.append(f"""
               <div class="total"><span>Total</span> <span>Rs {sale[1]:,.2f}</span></div>
             </div>
           </body>
         </html>
-        """
-        return html
-    except Exception as e:
-        return f"<h1>Error: {str(e)}</h1>"
+        """)
+    return "".join(parts)
+
+def serve_receipt(client_id):
+    # receipts of sales rung up on this till, found in the journal even before mysql has them
+    client_id = str(client_id)
+    entry = receipt_cache.get(client_id)
+    if entry is None:
+        data = sales_journal.load_receipt(client_id)
+        if data is None:
+            try:
+                with db_connection() as conn:
+                    c = conn.cursor()
+                    c.execute("SELECT id FROM sales WHERE client_id = %s", (client_id,))
+                    row = c.fetchone()
+                    data = load_receipt(conn, row[0]) if row else None
+            except Exception as e:
+                return f"<h1>Error: {str(e)}</h1>", 500
+        if data is None: return "<h1>Receipt Not Found</h1>", 404
+        entry = receipt_cache.put(client_id, render_receipt(receipt_number(client_id), *data))
+
+    body, etag = entry
+    resp = flask.Response(body, mimetype='text/html')
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = "public, max-age=31536000, immutable"
+    return resp.make_conditional(flask.request)
 
-# run flask in background thread
-def run_flask():
+def serve_bill(sale_id):
+    entry = receipt_cache.get(sale_id)
+    if entry is None:
+        try:
+            with db_connection() as conn:
+                data = load_receipt(conn, sale_id)
+        except Exception as e:
+            return f"<h1>Error: {str(e)}</h1>", 500
+        if data is None: return "<h1>Receipt Not Found</h1>", 404
+        entry = receipt_cache.put(sale_id, render_receipt(sale_id, *data))
+
+    body, etag = entry
+    resp = flask.Response(body, mimetype='text/html')
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = "public, max-age=31536000, immutable"
+    # answers 304 when the phone already has this version
+    return resp.make_conditional(flask.request)
+
+def health():
+    # used by monitoring and printed at startup
     try:
-        app_server.run(host='0.0.0.0', port=8000, debug=False, use_reloader=False)
-    except:
-        pass
+        with db_connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT 1")
+            c.fetchone()
+        db_ok = True
+    except storage.Error:
+        db_ok = False
+    # a till with mysql down still takes sales, the journal says how many are waiting
+    return (flask.jsonify(server=receipt_server.status, database=db_ok, journal=sales_journal.status,
+                          unsynced=sales_journal.backlog), (200 if db_ok else 503))
+
+def serve_metrics():
+    # prometheus scrapes this, per statement and call site timings plus the pool and journal
+    in_use, idle = db_pool.stats()
+    gauges = [("swiftsale_pool_in_use", "Pooled connections lent out", in_use),
+              ("swiftsale_pool_idle", "Pooled connections waiting", idle),
+              ("swiftsale_journal_unsynced", "Journaled sales not yet in the database", sales_journal.backlog)]
+    return flask.Response(query_metrics.prometheus(gauges), mimetype='text/plain; version=0.0.4')
+
+# receipt server settings
+RECEIPT_SERVER_CONFIG = {
+    'host': '0.0.0.0',
+    'port': 8000,
+    'threads': 8,
+    'timeout': 10,
+    'backlog': 128
+}
+
+# flask app to serve bills, built when the receipt server starts so flask
+# is only imported once the till is already up
+def create_receipt_app():
+    app = flask.Flask(__name__)
+    app.add_url_rule('/bill/<int:sale_id>', view_func=serve_bill)
+    app.add_url_rule('/r/<uuid:client_id>', view_func=serve_receipt)
+    app.add_url_rule('/health', view_func=health)
+    app.add_url_rule('/metrics', view_func=serve_metrics)
+    return app
+
+# werkzeug server with a fixed worker pool instead of a thread per request,
+# the classes are made here so werkzeug is imported with flask, not at launch
+def create_pooled_server(host, port, app, threads, backlog, timeout):
+    from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+    class ReceiptRequestHandler(WSGIRequestHandler):
+        # one request per connection. an idle keep-alive socket would pin a pooled worker
+        # until the timeout, and a queue of phones scanning at once could take every one.
+        # the timeout still drops clients that stall halfway through a request
+        protocol_version = "HTTP/1.0"
+
+    ReceiptRequestHandler.timeout = timeout
+
+    class PooledWSGIServer(BaseWSGIServer):
+        multithread = True
+
+        def __init__(self):
+            self.request_queue_size = backlog
+            super().__init__(host, port, app, handler=ReceiptRequestHandler)
+            self.workers = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='swiftsale-http')
+
+        def process_request(self, request, client_address):
+            self.workers.submit(self._handle, request, client_address)
+
+        def _handle(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+        def server_close(self):
+            super().server_close()
+            self.workers.shutdown(wait=False)
+
+    return PooledWSGIServer()
+
+# runs the receipt app next to the till and stops with it
+class ReceiptServer:
+    def __init__(self, create_app, host, port, threads=8, timeout=10, backlog=128):
+        self.create_app = create_app
+        self.app = None
+        self.host, self.port = host, port
+        self.threads, self.timeout, self.backlog = threads, timeout, backlog
+        self.status = 'stopped'
+        self._server = None
+
+    def start(self):
+        if self.app is None: self.app = self.create_app()
+        try:
+            if HAS_WAITRESS:
+                from waitress.server import create_server
+                self._server = create_server(self.app, host=self.host, port=self.port, threads=self.threads,
+                                             channel_timeout=self.timeout, backlog=self.backlog)
+                target = self._server.run
+            else:
+                self._server = create_pooled_server(self.host, self.port, self.app, self.threads, self.backlog, self.timeout)
+                target = self._server.serve_forever
+        except OSError as err:
+            # usually the port is taken, say so instead of failing silently
+            self.status = f"failed: {err}"
+            print(f"Receipt server could not start on {self.host}:{self.port}: {err}")
+            return False
+        threading.Thread(target=target, daemon=True, name='swiftsale-receipts').start()
+        self.status = 'running'
+        print(f"Receipt server on {self.host}:{self.port} ({'waitress' if HAS_WAITRESS else 'werkzeug'}, {self.threads} threads)")
+        return True
 
-threading.Thread(target=run_flask, daemon=True).start()
+    def stop(self):
+        if self._server is None: return
+        if HAS_WAITRESS:
+            self._server.close()
+            self._server.task_dispatcher.shutdown(timeout=self.timeout)
+        else:
+            self._server.shutdown()
+            self._server.server_close()
+        self._server = None
+        self.status = 'stopped'
+
+receipt_server = ReceiptServer(create_receipt_app, **RECEIPT_SERVER_CONFIG)
 
 # kivy widgets setup
 class ListGroup(BoxLayout):
@@ -269,58 +2135,188 @@ class DiscountSelect(BoxLayout):
     controller = ObjectProperty(None)
 
 # drawing icons with code
+# icon outlines in units of 1/25 of the icon's short side, centred on the origin.
+# each entry is the Line keywords plus a weight on the stroke width
+ICON_GEOMETRY = {
+    'settings': [({'circle': (0, 0, 6)}, 1)] + [
+        ({'points': [math.cos(a)*14, math.sin(a)*14, math.cos(a)*9, math.sin(a)*9]}, 1.5)
+        for a in (math.radians(d) for d in range(0, 360, 45))],
+    'pos': [
+        ({'points': [-6, 12, -6, 18, 6, 18, 6, 12]}, 1),
+        ({'rounded_rectangle': (-12, -14, 24, 26, 4)}, 1),
+        ({'circle': (0, -4, 2)}, 1),
+    ],
+    'inventory': [
+        ({'points': [0, 0, 0, -10]}, 1),
+        ({'points': [0, 0, -10, 6]}, 1),
+        ({'points': [0, 0, 10, 6]}, 1),
+        ({'points': [-10, 6, 0, 12, 10, 6, 10, -6, 0, -12, -10, -6], 'joint': 'round'}, 1),
+    ],
+    'customers': [
+        ({'circle': (0, 6, 5)}, 1),
+        ({'ellipse': (-10, -12, 20, 14, 0, 180)}, 1),
+    ],
+    'reports': [
+        ({'rounded_rectangle': (-10, -10, 6, 10, 0.5)}, 1),
+        ({'rounded_rectangle': (-3, -10, 6, 20, 0.5)}, 1),
+        ({'rounded_rectangle': (4, -10, 6, 15, 0.5)}, 1),
+    ],
+    'products': [
+        ({'points': [-8, 0, 0, 10, 12, 10, 12, -10, -8, -10, -8, 0, -16, 0]}, 1),
+        ({'circle': (-8, 0, 2)}, 1),
+    ],
+    'dues': [
+        ({'rounded_rectangle': (-12, -8, 24, 16, 3)}, 1),
+        ({'points': [-12, 2, 12, 2]}, 1),
+        ({'points': [-8, -4, 0, -4]}, 1),
+    ],
+    'default': [({'circle': (0, 0, 5)}, 1)],
+}
+ICON_GEOMETRY['sales'] = ICON_GEOMETRY['pos']
+ICON_GEOMETRY['stock'] = ICON_GEOMETRY['inventory']
+ICON_GEOMETRY['monthly'] = ICON_GEOMETRY['reports']
+ICON_GEOMETRY['top_product'] = ICON_GEOMETRY['products']
+
 class SVGIcon(Widget):
     icon_type = StringProperty('default')
     color = ListProperty([0.5, 0.5, 0.55, 1])
 
-    def __init__(self, **kwargs):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.build_canvas()
+        self.bind(icon_type=self.build_canvas, color=self.update_color,
+                  pos=self.update_transform, size=self.update_transform)
+
+    def build_canvas(self, *args):
+        # lines are made once per icon type, moving or resizing only touches the transform
+        self.canvas.clear()
+        with self.canvas:
+            self._color = Color(*self.color)
+            PushMatrix()
+            self._translate = Translate()
+            self._scale = Scale()
+            shapes = ICON_GEOMETRY.get(self.icon_type, ICON_GEOMETRY['default'])
+            self._lines = [(Line(**shape), weight) for shape, weight in shapes]
+            PopMatrix()
+        self._unit = None
+        self.update_transform()
+
+    def update_color(self, *args):
+        self._color.rgba = self.color
+
+    def update_transform(self, *args):
+        self._translate.xy = self.center
+        unit = min(self.width, self.height) * 0.04
+        if unit == self._unit or unit <= 0: return
+        self._unit = unit
+        self._scale.xyz = (unit, unit, 1)
+        # the scale would thicken strokes too, keep them at a fixed screen width
+        for line, weight in self._lines:
+            line.width = dp(1.3) * weight / unit
+
+# rounded card behind a widget, drawn once and moved along with it
+def rounded_background(widget, color, radius):
+    with widget.canvas.before:
+        Color(rgba=get_color_from_hex(color))
+        rect = RoundedRectangle(pos=widget.pos, size=widget.size, radius=[radius])
+    def follow(instance, value):
+        rect.pos = instance.pos
+        rect.size = instance.size
+    widget.bind(pos=follow, size=follow)
+    return rect
+
+# type-ahead settings
+TYPEAHEAD_CONFIG = {
+    'debounce': 0.15,
+    'min_chars': 2,
+    'fetch_limit': 50,
+    'cache_ttl': 30
+}
+
+# shared search-as-you-type pipeline: debounce, cancel in-flight queries,
+# and answer longer queries from a cached result set when it was complete
+class TypeAhead:
+    def __init__(self, fetch, on_results, key, match, local=None, show=5, debounce=None):
+        # fetch(conn, text, limit) runs on the db executor, local(text, limit) inline
+        # and may return None when it cannot answer; match(row, text) filters the cache
+        self.fetch = fetch
+        self.on_results = on_results
+        self.key = key
+        self.match = match
+        self.local = local
+        self.show = show
+        self.min_chars = TYPEAHEAD_CONFIG['min_chars']
+        self.fetch_limit = TYPEAHEAD_CONFIG['fetch_limit']
+        self._cache = None
+        self._pending = ""
+        self._trigger = Clock.create_trigger(self._fire, TYPEAHEAD_CONFIG['debounce'] if debounce is None else debounce)
+
+    def update(self, text):
+        # returns False when the text is too short to search
+        text = text.strip()
+        if len(text) < self.min_chars:
+            self.cancel()
+            return False
+        if self.local:
+            rows = self.local(text, self.show)
+            if rows is not None:
+                self.cancel()
+                self.on_results(rows)
+                return True
+
+        cache = self._cache
+        if cache and time.monotonic() - cache[3] < TYPEAHEAD_CONFIG['cache_ttl'] \
+                and cache[2] and text.lower().startswith(cache[0].lower()):
+            # "coca" after a complete answer for "coc" is just a filter
+            self.cancel()
+            self.on_results([r for r in cache[1] if self.match(r, text)][:self.show])
+            return True
+
+        self._pending = text
+        self._trigger.cancel()
+        self._trigger()
+        return True
+
+    def _fire(self, dt):
+        text, limit = self._pending, self.fetch_limit
+        db_executor.submit(lambda conn: self.fetch(conn, text, limit), partial(self._on_fetched, text), key=self.key)
+
+    def _on_fetched(self, text, rows):
+        self._cache = (text, rows, len(rows) < self.fetch_limit, time.monotonic())
+        self.on_results(rows[:self.show])
+
+    def cancel(self):
+        self._trigger.cancel()
+        db_executor.cancel(self.key)
+
+    def invalidate(self):
+        self._cache = None
+
+# dropdown that keeps its suggestion buttons and just relabels them
+class SuggestionDropdown(DropDown):
+    def __init__(self, on_pick, **kwargs):
         super().__init__(**kwargs)
-        self.bind(pos=self.update_canvas, size=self.update_canvas)
+        self.on_pick = on_pick
+        self._buttons = []
 
-    def update_canvas(self, *args):
-        self.canvas.clear()
-        cx, cy = self.center_x, self.center_y
-        w, h = self.width, self.height
-        s = min(w, h) * 0.04 
-        with self.canvas:
-            Color(*self.color)
-            width = dp(1.3)
-            # draw specific shape based on type
-            if self.icon_type == 'settings':
-                Line(circle=(cx, cy, 6*s), width=width)
-                for i in range(0, 360, 45):
-                    Line(points=[cx + math.cos(math.radians(i))*(14*s), cy + math.sin(math.radians(i))*(14*s), cx + math.cos(math.radians(i))*(9*s), cy + math.sin(math.radians(i))*(9*s)], width=width*1.5)
-            elif self.icon_type in ('pos', 'sales'): 
-                ox, oy = cx, cy - 2*s
-                Line(points=[ox-6*s, oy+14*s, ox-6*s, oy+20*s, ox+6*s, oy+20*s, ox+6*s, oy+14*s], width=width)
-                Line(rounded_rectangle=(ox-12*s, oy-12*s, 24*s, 26*s, 4*s), width=width)
-                Line(circle=(ox, oy-2*s, 2*s), width=width)
-            elif self.icon_type in ('inventory', 'stock'):
-                ox, oy = cx, cy
-                Line(points=[ox, oy, ox, oy-10*s], width=width)
-                Line(points=[ox, oy, ox-10*s, oy+6*s], width=width)
-                Line(points=[ox, oy, ox+10*s, oy+6*s], width=width)
-                Line(points=[ox-10*s, oy+6*s, ox, oy+12*s, ox+10*s, oy+6*s, ox+10*s, oy-6*s, ox, oy-12*s, ox-10*s, oy-6*s], width=width, joint='round')
-            elif self.icon_type == 'customers':
-                ox, oy = cx, cy
-                Line(circle=(ox, oy+6*s, 5*s), width=width)
-                Line(ellipse=(ox-10*s, oy-12*s, 20*s, 14*s, 0, 180), width=width)
-            elif self.icon_type in ('reports', 'monthly'):
-                ox, oy = cx - 10*s, cy - 10*s
-                Line(rounded_rectangle=(ox, oy, 6*s, 10*s, 1), width=width)
-                Line(rounded_rectangle=(ox+7*s, oy, 6*s, 20*s, 1), width=width)
-                Line(rounded_rectangle=(ox+14*s, oy, 6*s, 15*s, 1), width=width)
-            elif self.icon_type in ('products', 'top_product'):
-                ox, oy = cx, cy
-                Line(points=[ox-8*s, oy, ox, oy+10*s, ox+12*s, oy+10*s, ox+12*s, oy-10*s, ox-8*s, oy-10*s, ox-8*s, oy, ox-16*s, oy], width=width)
-                Line(circle=(ox-8*s, oy, 2*s), width=width)
-            elif self.icon_type == 'dues':
-                ox, oy = cx, cy
-                Line(rounded_rectangle=(ox-12*s, oy-8*s, 24*s, 16*s, 3*s), width=width)
-                Line(points=[ox-12*s, oy+2*s, ox+12*s, oy+2*s], width=width)
-                Line(points=[ox-8*s, oy-4*s, ox, oy-4*s], width=width)
-            else:
-                Line(circle=(cx, cy, 5*s), width=width)
+    def _make_button(self):
+        btn = Button(size_hint_y=None, height=dp(44), 
+                   background_color=get_color_from_hex('#FFFFFF'), 
+                   background_normal='',
+                   color=get_color_from_hex('#1D1D1F'),
+                   halign='left', padding_x=dp(15))
+        btn.bind(size=btn.setter('text_size')) 
+        btn.bind(on_release=lambda btn: self.on_pick(btn.text))
+        self._buttons.append(btn)
+        return btn
+
+    def show(self, texts):
+        for i, text in enumerate(texts):
+            btn = self._buttons[i] if i < len(self._buttons) else self._make_button()
+            btn.text = text
+            if btn.parent is None: self.add_widget(btn)
+        for btn in self._buttons[len(texts):]:
+            if btn.parent is not None: self.remove_widget(btn)
 
 class AutocompleteInput(TextInput):
     suggestions = ListProperty([])
@@ -329,7 +2325,10 @@ class AutocompleteInput(TextInput):
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.dropdown = DropDown()
+        self.dropdown = SuggestionDropdown(on_pick=self.select_suggestion)
+        self.typeahead = TypeAhead(fetch=self.find_matches, on_results=self.show_suggestions,
+                                   key=('autocomplete', id(self)), local=self.find_local,
+                                   match=lambda name, text: text.lower() in name.lower())
         self.bind(text=self.on_text_change)
         # default text input styling
         self.background_normal = ''
@@ -343,34 +2342,26 @@ class AutocompleteInput(TextInput):
 
     def on_text_change(self, instance, value):
         if self.is_selecting: return
-        if len(value) < 2:
+        if not self.typeahead.update(value):
+            if self.dropdown.parent: self.dropdown.dismiss()
+
+    def find_local(self, text, limit):
+        if not catalog.loaded: return None
+        return [r[1] for r in catalog.search(text, limit)]
+
+    def find_matches(self, conn, text, limit):
+        c = conn.cursor()
+        # find matches
+        c.execute("SELECT DISTINCT name FROM products WHERE name LIKE %s LIMIT %s", (f"%{text}%", limit))
+        return [r[0] for r in c.fetchall()]
+
+    def show_suggestions(self, results):
+        # update dropdown
+        if results:
+            self.dropdown.show(results)
+            if not self.dropdown.parent: self.dropdown.open(self)
+        else:
             if self.dropdown.parent: self.dropdown.dismiss()
-            return
-        try:
-            conn = get_db_connection()
-            c = conn.cursor()
-            # find matches
-            c.execute("SELECT DISTINCT name FROM products WHERE name LIKE %s LIMIT 5", (f"%{value}%",))
-            results = [r[0] for r in c.fetchall()]
-            conn.close()
-            
-            # update dropdown
-            self.dropdown.clear_widgets()
-            if results:
-                for name in results:
-                    btn = Button(text=name, size_hint_y=None, height=dp(44), 
-                               background_color=get_color_from_hex('#FFFFFF'), 
-                               background_normal='',
-                               color=get_color_from_hex('#1D1D1F'),
-                               halign='left', padding_x=dp(15))
-                    btn.bind(size=btn.setter('text_size')) 
-                    btn.bind(on_release=lambda btn: self.select_suggestion(btn.text))
-                    self.dropdown.add_widget(btn)
-                if not self.dropdown.parent: self.dropdown.open(self)
-            else:
-                if self.dropdown.parent: self.dropdown.dismiss()
-        except mysql.connector.Error:
-            pass
 
     def select_suggestion(self, text):
         self.is_selecting = True
@@ -498,6 +2489,24 @@ KV = """
         markup: True
         shorten_from: 'right'
 
+# rows and headers for the recycled lists, a ListRow that draws its own card
+<BrowseRow@ListRow>:
+    canvas.before:
+        Color:
+            rgba: hex('#FFFFFF')
+        Rectangle:
+            pos: self.pos
+            size: self.size
+
+<CategoryHeader@Label>:
+    color: hex('#8E8E93')
+    bold: True
+    font_size: sp(13)
+    halign: 'left'
+    valign: 'bottom'
+    text_size: self.size
+    padding: [dp(4), dp(6)]
+
 <DiscountSelect>:
     orientation: 'horizontal'
     size_hint_y: None
@@ -655,11 +2664,7 @@ KV = """
             halign: 'center'
             valign: 'middle'
 
-<CartItem@BoxLayout>:
-    name: ''
-    qty: ''
-    price: ''
-    delete_fn: None
+<CartItem>:
     size_hint_y: None
     height: dp(60)
     canvas.before:
@@ -694,6 +2699,13 @@ KV = """
         size_hint_x: 0.3
         font_size: sp(14)
         on_release: root.delete_fn()
+"""
+
+# each screen's rules, loaded just before the screen is first built
+SCREEN_KV = {}
+
+SCREEN_KV['login'] = """
+#:import hex kivy.utils.get_color_from_hex
 
 <LoginScreen>:
     canvas.before:
@@ -742,6 +2754,10 @@ KV = """
                 font_size: sp(14)
                 size_hint_y: None
                 height: dp(30)
+"""
+
+SCREEN_KV['dashboard'] = """
+#:import hex kivy.utils.get_color_from_hex
 
 <DashboardScreen>:
     canvas.before:
@@ -818,6 +2834,10 @@ KV = """
                     title: "Preferences"
                     icon_type: "settings"
                     on_release: app.root.current = 'settings'
+"""
+
+SCREEN_KV['pos'] = """
+#:import hex kivy.utils.get_color_from_hex
 
 <POSScreen>:
     canvas.before:
@@ -874,6 +2894,15 @@ KV = """
                 font_size: sp(13)
                 bold: True
 
+            # handheld scanners type the code and press Enter, kept apart from the search box
+            StyledInput:
+                id: scan_inp
+                hint_text: "Scan Barcode"
+                multiline: False
+                write_tab: False
+                text_validate_unfocus: False
+                on_text_validate: root.on_scan(self)
+
             BoxLayout:
                 size_hint_y: None
                 height: dp(50)
@@ -907,19 +2936,30 @@ KV = """
                     text: "Add"
                     size_hint_x: 0.2
                     on_release: root.add_item()
+            Label:
+                id: stock_msg
+                text: ""
+                size_hint_y: None
+                height: dp(20) if self.text else 0
+                color: hex('#FF3B30')
+                font_size: sp(13)
+                bold: True
             
-            ScrollView:
+            RecycleView:
+                id: cart_list
+                viewclass: 'CartItem'
                 canvas.before:
                     Color:
                         rgba: hex('#F2F2F7')
                     Rectangle:
                         pos: self.pos
                         size: self.size
-                BoxLayout:
-                    id: cart_list
+                RecycleBoxLayout:
                     orientation: 'vertical'
                     size_hint_y: None
                     height: self.minimum_height
+                    default_size: None, dp(60)
+                    default_size_hint: 1, None
                     padding: [0, dp(10)]
                     spacing: dp(10)
 
@@ -955,6 +2995,10 @@ KV = """
                 text: "Charge"
                 background_color: hex('#34C759')
                 on_release: root.open_payment_modal()
+"""
+
+SCREEN_KV['inventory'] = """
+#:import hex kivy.utils.get_color_from_hex
 
 <InventoryScreen>:
     canvas.before:
@@ -1003,7 +3047,7 @@ KV = """
                 height: self.minimum_height
                 
                 ListGroup:
-                    height: dp(270)
+                    height: dp(335)
                     padding: dp(20)
                     spacing: dp(15)
                     
@@ -1054,17 +3098,62 @@ KV = """
                             id: p_stock
                             hint_text: "Stock Qty"
                             input_filter: 'int'
+                    StyledInput:
+                        id: p_barcode
+                        hint_text: "Barcode (optional)"
+                        multiline: False
                             
                 PrimaryButton:
                     text: "Save Product"
                     on_release: root.upsert()
+
+                ListGroup:
+                    padding: dp(20)
+                    spacing: dp(15)
+
+                    Label:
+                        text: "Import Price List"
+                        font_size: sp(22)
+                        bold: True
+                        color: hex('#1C1C1E')
+                        size_hint_y: None
+                        height: dp(30)
+                        halign: 'left'
+                        text_size: self.size
+                    Label:
+                        text: "CSV with name and price columns, category, stock and barcode optional"
+                        color: hex('#8E8E93')
+                        font_size: sp(13)
+                        size_hint_y: None
+                        height: dp(20)
+                        halign: 'left'
+                        text_size: self.size
+                    StyledInput:
+                        id: import_path
+                        hint_text: "Path to CSV file"
+
+                PrimaryButton:
+                    text: "Import"
+                    disabled: root.busy
+                    on_release: root.import_csv()
+
                 Label:
-                    id: status
+                    id: status_label
                     text: ""
                     color: hex('#05CD99')
                     size_hint_y: None
                     height: dp(20)
                     font_size: sp(12)
+                ProgressBar:
+                    id: progress
+                    max: 1
+                    size_hint_y: None
+                    height: dp(20)
+                    opacity: 1 if root.busy else 0
+"""
+
+SCREEN_KV['reports'] = """
+#:import hex kivy.utils.get_color_from_hex
 
 <ReportScreen>:
     canvas.before:
@@ -1147,6 +3236,10 @@ KV = """
                 height: self.minimum_height
                 padding: dp(20)
                 spacing: dp(15)
+"""
+
+SCREEN_KV['database'] = """
+#:import hex kivy.utils.get_color_from_hex
 
 <DatabaseScreen>:
     canvas.before:
@@ -1195,20 +3288,49 @@ KV = """
                 hint_text: "Filter products..."
                 on_text: root.on_search(self, self.text)
 
-        ScrollView:
+        RelativeLayout:
             canvas.before:
                 Color:
                     rgba: hex('#F2F2F7')
                 Rectangle:
-                    pos: self.pos
+                    pos: 0, 0
                     size: self.size
-            BoxLayout:
+            RecycleView:
                 id: db_list
-                orientation: 'vertical'
-                size_hint_y: None
-                height: self.minimum_height
-                padding: [dp(20), dp(10), dp(20), dp(40)]
-                spacing: dp(15)
+                on_scroll_y: root.on_list_scroll(self)
+                RecycleBoxLayout:
+                    orientation: 'vertical'
+                    size_hint_y: None
+                    height: self.minimum_height
+                    key_viewclass: 'viewclass'
+                    default_size: None, dp(52)
+                    default_size_hint: 1, None
+                    padding: [dp(20), 0, dp(20), dp(40)]
+
+            # the header of the category scrolled under the top edge
+            CategoryHeader:
+                id: sticky_header
+                size_hint: None, None
+                height: dp(35)
+                pos_hint: {'top': 1}
+                x: dp(20)
+                width: self.parent.width - dp(40)
+                opacity: 1 if self.text else 0
+                canvas.before:
+                    Color:
+                        rgba: hex('#F2F2F7')
+                    Rectangle:
+                        pos: self.pos
+                        size: self.size
+
+            Label:
+                id: empty_msg
+                text: ""
+                color: 0.5, 0.5, 0.5, 1
+"""
+
+SCREEN_KV['customers'] = """
+#:import hex kivy.utils.get_color_from_hex
 
 <CustomerScreen>:
     canvas.before:
@@ -1249,68 +3371,90 @@ KV = """
                 size_hint_x: None
                 width: dp(70)
         
-        ScrollView:
-            BoxLayout:
-                orientation: 'vertical'
-                size_hint_y: None
-                height: self.minimum_height
-                spacing: dp(25)
+        BoxLayout:
+            orientation: 'vertical'
+            size_hint_y: None
+            height: self.minimum_height
+            spacing: dp(15)
+            padding: [dp(20), dp(20), dp(20), 0]
+
+            ListGroup:
+                height: dp(250)
                 padding: dp(20)
-                
-                ListGroup:
-                    height: dp(250)
-                    padding: dp(20)
-                    spacing: dp(15)
-                    
-                    Label:
-                        text: "Add New Contact"
-                        font_size: sp(20)
-                        bold: True
-                        color: hex('#1C1C1E')
-                        size_hint_y: None
-                        height: dp(30)
-                        halign: 'left'
-                        text_size: self.size
+                spacing: dp(15)
 
-                    StyledInput:
-                        id: c_name
-                        hint_text: "Full Name"
-                    StyledInput:
-                        id: c_phone
-                        hint_text: "Phone Number"
-                        input_filter: 'int'
-                    StyledInput:
-                        id: c_email
-                        hint_text: "Email Address"
-                
-                PrimaryButton:
-                    text: "Save Contact"
-                    on_release: root.add_customer()
                 Label:
-                    id: status
-                    text: ""
-                    color: hex('#05CD99')
+                    text: "Add New Contact"
+                    font_size: sp(20)
+                    bold: True
+                    color: hex('#1C1C1E')
                     size_hint_y: None
-                    height: dp(20)
-                    font_size: sp(12)
-                
+                    height: dp(30)
+                    halign: 'left'
+                    text_size: self.size
+
+                StyledInput:
+                    id: c_name
+                    hint_text: "Full Name"
+                StyledInput:
+                    id: c_phone
+                    hint_text: "Phone Number"
+                    input_filter: 'int'
+                StyledInput:
+                    id: c_email
+                    hint_text: "Email Address"
+
+            PrimaryButton:
+                text: "Save Contact"
+                on_release: root.add_customer()
+            Label:
+                id: status
+                text: ""
+                color: hex('#05CD99')
+                size_hint_y: None
+                height: dp(20)
+                font_size: sp(12)
+
+            BoxLayout:
+                size_hint_y: None
+                height: dp(50)
+                spacing: dp(10)
                 Label:
                     text: "All Contacts"
                     color: hex('#8E8E93')
                     bold: True
                     font_size: sp(14)
-                    size_hint_y: None
-                    height: dp(30)
+                    size_hint_x: 0.35
                     halign: 'left'
+                    valign: 'middle'
                     text_size: self.size
                     padding_x: dp(10)
-                
-                BoxLayout:
-                    id: cust_list
+                StyledInput:
+                    id: cust_search
+                    hint_text: "Search by name..."
+                    on_text: root.show_customers(self.text)
+
+        RelativeLayout:
+            RecycleView:
+                id: cust_list
+                on_scroll_y: root.on_list_scroll(self)
+                RecycleBoxLayout:
                     orientation: 'vertical'
                     size_hint_y: None
                     height: self.minimum_height
-                    spacing: dp(15)
+                    key_viewclass: 'viewclass'
+                    default_size: None, dp(52)
+                    default_size_hint: 1, None
+                    padding: [dp(20), dp(10), dp(20), dp(40)]
+
+            Label:
+                id: empty_msg
+                text: ""
+                color: 0.5, 0.5, 0.5, 1
+"""
+
+SCREEN_KV['settings'] = """
+#:import hex kivy.utils.get_color_from_hex
 
 <SettingsScreen>:
     canvas.before:
@@ -1367,6 +3511,7 @@ KV = """
                         background_color: 0,0,0,0
                         color: hex('#007AFF')
                         font_size: sp(17)
+                        disabled: root.busy
                         on_release: root.backup_db()
                     
                     Widget:
@@ -1387,318 +3532,579 @@ KV = """
                         background_color: 0,0,0,0
                         color: hex('#007AFF')
                         font_size: sp(17)
+                        disabled: root.busy
                         on_release: root.export_csv()
 
-                    Widget:
-                        size_hint_y: None
-                        height: 1
-                        canvas:
-                            Color:
-                                rgba: hex('#C6C6C8')
-                            Rectangle:
-                                pos: self.x + dp(16), self.y
-                                size: self.width - dp(16), 1
+                    BoxLayout:
+                        size_hint_y: None
+                        height: dp(62)
+                        padding: [dp(16), dp(6)]
+                        spacing: dp(10)
+                        StyledInput:
+                            id: export_from
+                            hint_text: "From (YYYY-MM-DD)"
+                        StyledInput:
+                            id: export_to
+                            hint_text: "To (YYYY-MM-DD)"
+
+                    Widget:
+                        size_hint_y: None
+                        height: 1
+                        canvas:
+                            Color:
+                                rgba: hex('#C6C6C8')
+                            Rectangle:
+                                pos: self.x + dp(16), self.y
+                                size: self.width - dp(16), 1
+
+                    Button:
+                        text: "Diagnostics"
+                        size_hint_y: None
+                        height: dp(52)
+                        background_normal: ''
+                        background_color: 0,0,0,0
+                        color: hex('#007AFF')
+                        font_size: sp(17)
+                        on_release: app.root.current = 'diagnostics'
+
+                    Widget:
+                        size_hint_y: None
+                        height: 1
+                        canvas:
+                            Color:
+                                rgba: hex('#C6C6C8')
+                            Rectangle:
+                                pos: self.x + dp(16), self.y
+                                size: self.width - dp(16), 1
+
+                    Button:
+                        text: "About"
+                        size_hint_y: None
+                        height: dp(52)
+                        background_normal: ''
+                        background_color: 0,0,0,0
+                        color: hex('#007AFF')
+                        font_size: sp(17)
+                        on_release: root.show_about()
+                
+                Label:
+                    id: status_label
+                    text: ""
+                    color: hex('#8E8E93')
+                    size_hint_y: None
+                    height: dp(30)
+                    font_size: sp(13)
+                    halign: 'center'
+                    text_size: self.size
+
+                ProgressBar:
+                    id: progress
+                    max: 1
+                    size_hint_y: None
+                    height: dp(20)
+                    opacity: 1 if root.busy else 0
+"""
+
+SCREEN_KV['diagnostics'] = """
+#:import hex kivy.utils.get_color_from_hex
+
+<DiagnosticsScreen>:
+    canvas.before:
+        Color:
+            rgba: hex('#F2F2F7')
+        Rectangle:
+            pos: self.pos
+            size: self.size
+    BoxLayout:
+        orientation: 'vertical'
+        BoxLayout:
+            size_hint_y: None
+            height: dp(55)
+            padding: dp(10)
+            canvas.before:
+                Color:
+                    rgba: hex('#F9F9F9')
+                Rectangle:
+                    pos: self.pos
+                    size: self.size
+            Button:
+                text: "Back"
+                size_hint_x: None
+                width: dp(70)
+                background_color: 0,0,0,0
+                color: hex('#007AFF')
+                font_size: sp(17)
+                on_release: app.root.current = 'settings'
+            Label:
+                text: "Diagnostics"
+                color: hex('#1C1C1E')
+                bold: True
+                font_size: sp(17)
+                halign: 'center'
+                text_size: self.size
+            Button:
+                text: "Reset"
+                size_hint_x: None
+                width: dp(70)
+                background_color: 0,0,0,0
+                color: hex('#007AFF')
+                font_size: sp(17)
+                on_release: root.reset()
+
+        Label:
+            id: summary
+            text: ""
+            color: hex('#8E8E93')
+            bold: True
+            font_size: sp(13)
+            size_hint_y: None
+            height: dp(40)
+            halign: 'left'
+            padding_x: dp(20)
+            text_size: self.size
 
-                    Button:
-                        text: "About"
-                        size_hint_y: None
-                        height: dp(52)
-                        background_normal: ''
-                        background_color: 0,0,0,0
-                        color: hex('#007AFF')
-                        font_size: sp(17)
-                        on_release: root.show_about()
-                
-                Label:
-                    id: status_label
-                    text: ""
-                    color: hex('#8E8E93')
-                    size_hint_y: None
-                    height: dp(30)
-                    font_size: sp(13)
-                    halign: 'center'
-                    text_size: self.size
+        # slowest first by total time, so the busiest screen is at the top
+        RecycleView:
+            id: query_list
+            RecycleBoxLayout:
+                orientation: 'vertical'
+                size_hint_y: None
+                height: self.minimum_height
+                key_viewclass: 'viewclass'
+                default_size: None, dp(52)
+                default_size_hint: 1, None
+                padding: [dp(20), 0, dp(20), dp(40)]
 """
 
-Builder.load_string(KV)
+# a screen that runs one long job at a time on a thread of its own, so the db
+# workers stay free for the till. progress shows in its 'progress' bar and 'status_label'
+class JobScreen(Screen):
+    busy = BooleanProperty(False)
+
+    def run_job(self, job, done):
+        # job(progress) returns a result and done(result) turns it into the status line
+        if self.busy: return
+        self.busy = True
+        self.ids.progress.value = 0
+        def report(fraction, text):
+            Clock.schedule_once(lambda dt: self.show_progress(fraction, text), 0)
+        def work():
+            schema_ready.wait()
+            try:
+                message = done(job(report))
+            except Exception as err:
+                message = f"Failed: {err}"
+            Clock.schedule_once(lambda dt: self.job_finished(message), 0)
+        threading.Thread(target=work, daemon=True, name='swiftsale-job').start()
+
+    def show_progress(self, fraction, text):
+        if not self.busy: return
+        self.ids.progress.value = fraction
+        self.ids.status_label.text = text
+
+    def job_finished(self, message):
+        self.busy = False
+        self.ids.status_label.text = message
 
 class LoginScreen(Screen):
     def do_login(self):
         u = self.ids.user.text.strip()
         p = self.ids.pwd.text.strip()
-        try:
-            conn = get_db_connection()
+
+        def check(conn):
             c = conn.cursor()
             # check credentials
             c.execute("SELECT role FROM users WHERE username=%s AND password=%s", (u, p))
-            res = c.fetchone()
-            conn.close()
-            if res:
-                self.manager.current = 'dashboard'
-                self.ids.err.text = ""
-            else:
-                self.ids.err.text = "Invalid credentials"
-        except mysql.connector.Error as e:
-            self.ids.err.text = "DB Connection Error"
+            return c.fetchone()
+        db_executor.submit(check, self.on_login_result, self.on_login_error, key='login')
+
+    def on_login_result(self, res):
+        if res:
+            self.manager.current = 'dashboard'
+            self.ids.err.text = ""
+        else:
+            self.ids.err.text = "Invalid credentials"
+
+    def on_login_error(self, err):
+        self.ids.err.text = "DB Connection Error"
 
 class DashboardScreen(Screen):
     def on_enter(self):
         self.update_stats()
 
     def update_stats(self):
-        self.ids.stats_carousel.clear_widgets()
-        try:
-            conn = get_db_connection()
+        def load_stats(conn):
             c = conn.cursor()
-            today = datetime.datetime.now().strftime("%Y-%m-%d")
-            month = datetime.datetime.now().strftime("%Y-%m")
-            
-            # calculate today's total
-            c.execute("SELECT sum(total) FROM sales WHERE date LIKE %s", (f"{today}%",))
-            today_val = c.fetchone()[0] or 0
-            self.ids.stats_carousel.add_widget(StatSlide(
-                title="Today", value=f"Rs {today_val:,.0f}",
-                icon="sales", color=get_color_from_hex('#34C759')))
-
-            # calculate month's total
-            c.execute("SELECT sum(total) FROM sales WHERE date LIKE %s", (f"{month}%",))
-            month_val = c.fetchone()[0] or 0
-            self.ids.stats_carousel.add_widget(StatSlide(
-                title="This Month", value=f"Rs {month_val:,.0f}",
-                icon="monthly", color=get_color_from_hex('#007AFF')))
+            now = datetime.datetime.now()
+            stats = {}
+
+            # today, this month and all-time totals are single rollup rows
+            (_, today), (_, month), _ = rollup_periods(now)
+            c.execute("""SELECT period_type, total, paid_total FROM sales_rollup
+                         WHERE (period_type = 'day' AND period = %s) OR (period_type = 'month' AND period = %s)
+                            OR (period_type = 'all' AND period = 'all')""", (today, month))
+            totals = {r[0]: (r[1], r[2]) for r in c.fetchall()}
+            stats['today'] = totals.get('day', (0, 0))[0]
+            stats['month'] = totals.get('month', (0, 0))[0]
 
             # check for low stock items
             c.execute("SELECT count(*) FROM products WHERE stock < 20")
-            low_stock = c.fetchone()[0]
-            self.ids.stats_carousel.add_widget(StatSlide(
-                title="Restock Needed", value=f"{low_stock} items",
-                icon="stock", color=get_color_from_hex('#FF3B30')))
+            stats['low_stock'] = c.fetchone()[0]
 
             # calculate pending dues
-            c.execute("SELECT sum(total) FROM sales")
-            total_sales = c.fetchone()[0] or 0
-            c.execute("SELECT sum(amount) FROM payments")
-            total_paid = c.fetchone()[0] or 0
-            dues = total_sales - total_paid
-            if dues < 1: dues = 0 
-            self.ids.stats_carousel.add_widget(StatSlide(
-                title="Pending Dues", value=f"Rs {dues:,.0f}",
-                icon="dues", color=get_color_from_hex('#FF9500')))
+            total_sales, total_paid = totals.get('all', (0, 0))
+            stats['dues'] = total_sales - total_paid
 
             # find best selling product
-            c.execute("SELECT product_name FROM sales_items GROUP BY product_name ORDER BY SUM(qty) DESC LIMIT 1")
+            c.execute("SELECT product_name FROM product_rollup ORDER BY qty DESC LIMIT 1")
             top = c.fetchone()
-            top_name = top[0] if top else "N/A"
-            if len(top_name) > 18: top_name = top_name[:16] + ".."
-            self.ids.stats_carousel.add_widget(StatSlide(
-                title="Top Performer", value=top_name,
-                icon="top_product", color=get_color_from_hex('#5856D6')))
+            stats['top'] = top[0] if top else "N/A"
+            return stats
+        db_executor.submit(load_stats, self.show_stats, key='dashboard')
 
-            conn.close()
-        except mysql.connector.Error:
-            pass
+    def show_stats(self, stats):
+        self.ids.stats_carousel.clear_widgets()
+        self.ids.stats_carousel.add_widget(StatSlide(
+            title="Today", value=f"Rs {stats['today']:,.0f}",
+            icon="sales", color=get_color_from_hex('#34C759')))
+        self.ids.stats_carousel.add_widget(StatSlide(
+            title="This Month", value=f"Rs {stats['month']:,.0f}",
+            icon="monthly", color=get_color_from_hex('#007AFF')))
+        self.ids.stats_carousel.add_widget(StatSlide(
+            title="Restock Needed", value=f"{stats['low_stock']} items",
+            icon="stock", color=get_color_from_hex('#FF3B30')))
+
+        dues = stats['dues']
+        if dues < 1: dues = 0 
+        self.ids.stats_carousel.add_widget(StatSlide(
+            title="Pending Dues", value=f"Rs {dues:,.0f}",
+            icon="dues", color=get_color_from_hex('#FF9500')))
+
+        top_name = stats['top']
+        if len(top_name) > 18: top_name = top_name[:16] + ".."
+        self.ids.stats_carousel.add_widget(StatSlide(
+            title="Top Performer", value=top_name,
+            icon="top_product", color=get_color_from_hex('#5856D6')))
 
 class POSScreen(Screen):
-    cart = ListProperty([])
     selected_customer_id = NumericProperty(0)
 
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.cart = Cart()
+        # product id -> position of its row in the cart view's data
+        self._cart_rows = {}
+
     def on_enter(self):
-        self.ids.cust_search.bind(text=self.on_customer_search)
+        # on_enter fires on every visit, only wire the search box once
+        if not hasattr(self, 'cust_typeahead'):
+            self.cust_typeahead = TypeAhead(fetch=self.find_customers, on_results=self.on_customer_found,
+                                            key='customer_search', show=1,
+                                            match=lambda r, text: text.lower() in r[1].lower() or text in (r[2] or ''))
+            self.ids.cust_search.bind(text=self.on_customer_search)
 
     def on_customer_search(self, instance, value):
-        if len(value) < 2:
+        if not self.cust_typeahead.update(value):
             self.selected_customer_id = 0
             self.ids.cust_pref_label.text = ""
-            return
-        try:
-            conn = get_db_connection()
-            c = conn.cursor()
-            # find customer by name or phone
-            c.execute("""SELECT c.id, c.name FROM customers c WHERE c.name LIKE %s OR c.phone LIKE %s LIMIT 1""", (f"%{value}%", f"%{value}%"))
-            result = c.fetchone()
-            conn.close()
-            if result:
-                self.selected_customer_id = result[0]
-                self.ids.cust_pref_label.text = f"Matched: {result[1]}"
-        except mysql.connector.Error:
-            pass
+
+    def find_customers(self, conn, text, limit):
+        c = conn.cursor()
+        # find customer by name or phone
+        c.execute("""SELECT c.id, c.name, c.phone FROM customers c WHERE c.name LIKE %s OR c.phone LIKE %s LIMIT %s""", (f"%{text}%", f"%{text}%", limit))
+        return c.fetchall()
+
+    def on_customer_found(self, rows):
+        if rows:
+            self.selected_customer_id = rows[0][0]
+            self.ids.cust_pref_label.text = f"Matched: {rows[0][1]}"
 
     def add_item(self):
         q = self.ids.prod_inp.text.strip()
         try: qty = int(self.ids.qty_inp.text.strip())
         except ValueError: qty = 0 
         if qty <= 0 or not q: return
+        if catalog.loaded:
+            self.on_product_found(qty, catalog.resolve(q))
+            return
 
-        try:
-            conn = get_db_connection()
+        def find_product(conn):
             c = conn.cursor()
-            # find product
-            c.execute("SELECT * FROM products WHERE name LIKE %s", (f"%{q}%",))
-            prod = c.fetchone()
-            conn.close()
+            # find product, an exact barcode first
+            c.execute("SELECT id, name, category, price, stock, barcode FROM products WHERE barcode = %s", (q,))
+            row = c.fetchone()
+            if row: return row
+            c.execute("SELECT id, name, category, price, stock, barcode FROM products WHERE name LIKE %s LIMIT 1", (f"%{q}%",))
+            return c.fetchone()
+        db_executor.submit(find_product, partial(self.on_product_found, qty))
+
+    def on_scan(self, field):
+        # one unit per scan, added without going near the autocomplete
+        code = field.text.strip()
+        field.text = ""
+        if not code: return
+        prod = catalog.by_barcode(code) if catalog.loaded else None
+        if prod is not None:
+            self.on_scanned(code, prod)
+            return
+        # not in the index yet, eg. added on another till since the last refresh
+        def find_barcode(conn):
+            c = conn.cursor()
+            c.execute("SELECT id, name, category, price, stock, barcode FROM products WHERE barcode = %s", (code,))
+            row = c.fetchone()
+            if row and catalog.loaded: catalog.put(row)
+            return row
+        db_executor.submit(find_barcode, partial(self.on_scanned, code))
 
-            if prod:
-                # check if already in cart
-                found = False
-                for item in self.cart:
-                    if item['id'] == prod[0]:
-                        item['qty'] += qty
-                        found = True
-                        break
-                if not found:
-                    self.cart.append({'id': prod[0], 'name': prod[1], 'price': prod[3], 'qty': qty})
-                self.refresh_cart()
-                self.ids.prod_inp.text = ""
-                self.ids.qty_inp.text = "0"
-        except mysql.connector.Error:
-            pass
-
-    def refresh_cart(self):
-        self.ids.cart_list.clear_widgets()
-        total = 0
-        for i, item in enumerate(self.cart):
-            # create ui row for item
-            w = CartItem(name=item['name'], qty=f"{item['qty']}", 
-                        price=f"Rs {item['price']*item['qty']:.0f}")
-            w.delete_fn = partial(self.remove_item, i)
-            self.ids.cart_list.add_widget(w)
-            total += item['price'] * item['qty']
-        self.ids.total_lbl.text = f"Rs {total:,.2f}"
-
-    def remove_item(self, idx):
-        if 0 <= idx < len(self.cart):
-            del self.cart[idx]
-            self.refresh_cart()
+    def on_scanned(self, code, prod):
+        if prod is None:
+            self.ids.stock_msg.text = f"Unknown barcode {code}"
+            return
+        self.on_product_found(1, prod, scanned=True)
+
+    def on_product_found(self, qty, prod, scanned=False):
+        if not prod: return
+        # hold the stock before it goes in the cart so another till cannot sell it
+        db_executor.submit(lambda conn: run_transaction(conn, lambda c: reserve_stock(c, prod[0], qty)),
+                           partial(self.on_stock_reserved, qty, prod, scanned), self.on_reserve_failed)
+
+    def on_reserve_failed(self, err):
+        if isinstance(err, OutOfStock):
+            self.ids.stock_msg.text = f"Only {err.available} left in stock"
+        else:
+            self.ids.stock_msg.text = "DB Error"
+
+    def on_stock_reserved(self, qty, prod, scanned, result):
+        self.ids.stock_msg.text = ""
+        # bill from the row reserve_stock read, and let the index catch up with it
+        if result is not None:
+            prod = result
+            if catalog.loaded: catalog.put(prod)
+        # merges into the existing line when the product is already in the cart
+        line, is_new = self.cart.add(prod[0], prod[1], prod[3], qty)
+        self.show_cart_line(line, is_new)
+        # a scan leaves whatever is half-typed in the search box alone
+        if scanned: return
+        self.ids.prod_inp.text = ""
+        self.ids.qty_inp.text = "0"
+
+    # the cart view is a recycled list, changes touch one row of its data and
+    # only the rows on screen have widgets behind them
+
+    def _cart_row(self, line):
+        return {'name': line.name, 'qty': f"{line.qty}", 'price': f"Rs {line.amount:.0f}",
+                'delete_fn': partial(self.remove_item, line.product_id)}
+
+    def show_cart_line(self, line, is_new):
+        data = self.ids.cart_list.data
+        if is_new:
+            self._cart_rows[line.product_id] = len(data)
+            data.append(self._cart_row(line))
+        else:
+            data[self._cart_rows[line.product_id]] = self._cart_row(line)
+        self.update_total()
+
+    def drop_cart_line(self, product_id):
+        idx = self._cart_rows.pop(product_id)
+        del self.ids.cart_list.data[idx]
+        for pid, i in self._cart_rows.items():
+            if i > idx: self._cart_rows[pid] = i - 1
+        self.update_total()
+
+    def clear_cart_view(self):
+        self._cart_rows = {}
+        self.ids.cart_list.data = []
+        self.update_total()
+
+    def update_total(self):
+        self.ids.total_lbl.text = f"Rs {self.cart.total:,.2f}"
+
+    def remove_item(self, product_id):
+        if self.cart.remove(product_id) is not None:
+            self.drop_cart_line(product_id)
+            db_executor.submit(lambda conn: run_transaction(conn, lambda c: release_reservations(c, [product_id])))
 
     def open_payment_modal(self):
         if not self.cart: return
-        # parse current total
-        total = float(self.ids.total_lbl.text.replace('Rs ','').replace(',',''))
-        modal = SplitPaymentModal(total_due=total, 
+        self.cart.discount_rate = Decimal('0')
+        modal = SplitPaymentModal(cart=self.cart,
                                  customer_id=self.selected_customer_id,
-                                 cart_items=self.cart.copy(),
                                  callback=self.on_payment_complete)
         modal.open()
 
-    def on_payment_complete(self, sale_id):
+    def on_payment_complete(self, client_id):
         # reset cart after sale
-        self.cart = []
-        self.refresh_cart()
+        self.cart.clear()
+        self.clear_cart_view()
         self.ids.cust_search.text = ""
-        self.show_qr_receipt(sale_id)
+        self.show_qr_receipt(client_id)
 
-    def show_qr_receipt(self, sale_id):
-        qr_screen = QRReceiptPopup(sale_id=sale_id)
+    def show_qr_receipt(self, client_id):
+        qr_screen = QRReceiptPopup(client_id=client_id)
         qr_screen.open()
 
 class SplitPaymentModal(Popup):
     discount = NumericProperty(0)
     
-    def __init__(self, total_due, customer_id, cart_items, callback, **kwargs):
+    def __init__(self, cart, customer_id, callback, **kwargs):
         super().__init__(**kwargs)
         self.title = ''
         self.size_hint = (0.85, 0.6)
-        self.original_total = total_due
-        self.total_due = total_due
+        self.cart = cart
         self.customer_id = customer_id
-        self.cart_items = cart_items
         self.callback = callback
         
         # build modal ui
         self.main_layout = BoxLayout(orientation='vertical', padding=dp(20), spacing=dp(15))
-        with self.main_layout.canvas.before:
-            Color(rgba=get_color_from_hex('#F2F2F7'))
-            Rectangle(pos=self.main_layout.pos, size=self.main_layout.size)
-        self.main_layout.bind(pos=lambda i,v: self._bg(i), size=lambda i,v: self._bg(i))
+        rounded_background(self.main_layout, '#FFFFFF', dp(16))
         
-        self.header_lbl = Label(text=f"Total: Rs {total_due:,.2f}", bold=True, font_size=sp(22), color=get_color_from_hex('#1C1C1E'))
+        self.header_lbl = Label(text=f"Total: Rs {cart.total:,.2f}", bold=True, font_size=sp(22), color=get_color_from_hex('#1C1C1E'))
         self.main_layout.add_widget(self.header_lbl)
         
         disc = DiscountSelect()
         disc.controller = self 
         self.main_layout.add_widget(disc)
         
-        btn = Button(text="Confirm Cash", size_hint_y=None, height=dp(50), background_color=get_color_from_hex('#34C759'))
-        btn.bind(on_release=self.complete_sale)
-        self.main_layout.add_widget(btn)
+        self.confirm_btn = Button(text="Confirm Cash", size_hint_y=None, height=dp(50), background_color=get_color_from_hex('#34C759'))
+        self.confirm_btn.bind(on_release=self.complete_sale)
+        self.main_layout.add_widget(self.confirm_btn)
         
         self.content = self.main_layout
 
-    def _bg(self, i):
-        i.canvas.before.clear()
-        with i.canvas.before:
-            Color(rgba=get_color_from_hex('#FFFFFF'))
-            RoundedRectangle(pos=i.pos, size=i.size, radius=[dp(16)])
-
     def set_discount(self, val):
         self.discount = val
-        self.total_due = self.original_total * (1 - val)
-        self.header_lbl.text = f"Total: Rs {self.total_due:,.2f} (-{int(val*100)}%)"
+        self.cart.discount_rate = Decimal(str(val))
+        self.header_lbl.text = f"Total: Rs {self.cart.total:,.2f} (-{int(val*100)}%)"
 
     def complete_sale(self, *args):
-        try:
-            conn = get_db_connection()
-            c = conn.cursor()
-            dt = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            # create sale record
-            c.execute("INSERT INTO sales (date, total, customer_id, qr_data) VALUES (%s,%s,%s,%s)", (dt, self.total_due, self.customer_id, "TEMP"))
-            sale_id = c.lastrowid
-            
-            # generate bill url
-            url = f"http://localhost:8000/bill/{sale_id}"
-            c.execute("UPDATE sales SET qr_data=%s WHERE id=%s", (url, sale_id))
-            
-            # save items and update stock
-            for item in self.cart_items:
-                c.execute("INSERT INTO sales_items (sale_id, product_id, product_name, qty, price) VALUES (%s,%s,%s,%s,%s)",
-                        (sale_id, item['id'], item['name'], int(item['qty']), item['price']))
-                c.execute("UPDATE products SET stock = stock - %s WHERE id=%s", (int(item['qty']), item['id']))
-                
-            # record payment
-            c.execute("INSERT INTO payments (sale_id, method, amount, timestamp) VALUES (%s,%s,%s,%s)", (sale_id, "cash", self.total_due, dt))
-            conn.commit()
-            conn.close()
-            self.callback(sale_id)
-            self.dismiss()
-        except mysql.connector.Error as err:
+        # guard against a double tap charging twice while the insert is in flight
+        self.confirm_btn.disabled = True
+        # exact Decimal amounts straight from the cart, nothing parsed back from labels
+        total_due, discount, customer_id = self.cart.total, self.cart.discount, self.customer_id
+        cart_items = self.cart.as_items()
+        # the till names the sale, so a replay can never record it twice
+        client_id = str(uuid.uuid4())
+        now = datetime.datetime.now()
+        payments = [("cash", total_due)]
+
+        def warm_receipt():
+            # start the qr bitmap and warm the receipt page from what we already have
+            if HAS_QRCODE: qr_renderer.prepare(receipt_url(client_id))
+            receipt_cache.put(client_id, render_receipt(receipt_number(client_id), (now.strftime("%Y-%m-%d %H:%M:%S"), total_due),
+                                                        [(item['name'], int(item['qty']), item['price']) for item in cart_items]))
+
+        if sales_journal.path:
+            # committed locally in a few ms whatever state mysql is in, synced behind the scenes
+            def journaled(err):
+                if err is None: warm_receipt()
+                Clock.schedule_once(lambda dt: self.on_sale_failed(err) if err else self.on_sale_saved(client_id))
+            sales_journal.append(client_id, sale_payload(now, total_due, discount, customer_id, cart_items, payments), journaled)
+            return
+
+        def save_sale(conn):
+            run_transaction(conn, lambda c: record_sale(c, now, total_due, discount, customer_id,
+                                                        cart_items, payments, client_id=client_id))
+            warm_receipt()
+            return client_id
+        db_executor.submit(save_sale, self.on_sale_saved, self.on_sale_failed)
+
+    def on_sale_saved(self, client_id):
+        self.callback(client_id)
+        self.dismiss()
+
+    def on_sale_failed(self, err):
+        if isinstance(err, OutOfStock):
+            line = self.cart.lines.get(err.product_id)
+            name = line.name if line else "An item"
+            self.header_lbl.text = f"{name}: only {err.available} left"
+        else:
             print(err)
+        self.confirm_btn.disabled = False
+
+# qr rendering settings
+QR_CONFIG = {
+    'texture_cache': 8,
+    'workers': 1
+}
+
+# builds qr bitmaps off the ui thread, straight to rgba with no png round trip
+class QRRenderer:
+    def __init__(self, texture_cache=8, workers=1):
+        self.cache_size = texture_cache
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='swiftsale-qr')
+        self._textures = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _bitmap(data):
+        qr = qrcode.QRCode(border=4)
+        qr.add_data(data)
+        qr.make(fit=True)
+        matrix = qr.get_matrix()
+        black, white = b'\x00\x00\x00\xff', b'\xff\xff\xff\xff'
+        # one pixel per module, bottom row first like kivy textures
+        return len(matrix), b''.join(black if cell else white for row in reversed(matrix) for cell in row)
+
+    def prepare(self, data):
+        # safe from any thread, eg. the checkout worker as soon as the sale id is known
+        with self._lock:
+            if data in self._textures or data in self._pending: return
+            self._pending[data] = self._pool.submit(self._bitmap, data)
+
+    def texture(self, data, callback):
+        # callback(texture) on the kivy thread, straight away when it is cached
+        tex = self._textures.get(data)
+        if tex is not None:
+            self._textures.move_to_end(data)
+            callback(tex)
+            return
+        self.prepare(data)
+        with self._lock:
+            future = self._pending.get(data)
+        if future is None:
+            # finished between the two checks above
+            return self.texture(data, callback)
+        future.add_done_callback(lambda f: Clock.schedule_once(lambda dt: self._upload(data, f, callback)))
+
+    def _upload(self, data, future, callback):
+        tex = self._textures.get(data)
+        if tex is None:
+            size, buf = future.result()
+            # textures live on the gl thread, upload once and let the gpu scale it
+            tex = Texture.create(size=(size, size), colorfmt='rgba')
+            tex.mag_filter = 'nearest'
+            tex.min_filter = 'nearest'
+            tex.blit_buffer(buf, colorfmt='rgba', bufferfmt='ubyte')
+            self._textures[data] = tex
+            while len(self._textures) > self.cache_size:
+                self._textures.popitem(last=False)
+        with self._lock:
+            self._pending.pop(data, None)
+        callback(tex)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+qr_renderer = QRRenderer(**QR_CONFIG)
 
 class QRReceiptPopup(Popup):
-    sale_id = NumericProperty(0)
-    def __init__(self, sale_id, **kwargs):
+    client_id = StringProperty("")
+    def __init__(self, client_id, **kwargs):
         super().__init__(**kwargs)
-        self.sale_id = sale_id
+        self.client_id = client_id
         self.title = ""
         self.separator_height = 0
         self.size_hint = (0.85, 0.75)
         
-        # get qr url from db
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("SELECT qr_data, total FROM sales WHERE id=%s", (sale_id,))
-        res = c.fetchone()
-        qr_data = res[0]
-        conn.close()
-        
         layout = BoxLayout(orientation='vertical', padding=dp(20), spacing=dp(20))
-        with layout.canvas.before:
-            Color(rgba=get_color_from_hex('#FFFFFF'))
-            RoundedRectangle(pos=layout.pos, size=layout.size, radius=[dp(20)])
-        layout.bind(pos=lambda i,v: self._bg(i), size=lambda i,v: self._bg(i))
+        rounded_background(layout, '#FFFFFF', dp(20))
         
         layout.add_widget(Label(text="Success", font_size=sp(24), bold=True, color=get_color_from_hex('#1C1C1E'), size_hint_y=None, height=dp(40)))
         
-        # generate qr image
+        self.qr_image = Image(allow_stretch=True, keep_ratio=True)
         if HAS_QRCODE:
-            qr = qrcode.QRCode(box_size=10)
-            qr.add_data(qr_data)
-            qr.make(fit=True)
-            img = qr.make_image(fill_color="black", back_color="white")
-            buf = io.BytesIO()
-            img.save(buf, format='PNG')
-            buf.seek(0)
-            layout.add_widget(Image(texture=CoreImage(buf, ext='png').texture))
+            layout.add_widget(self.qr_image)
             
         layout.add_widget(Label(text="Scan for digital receipt", color=get_color_from_hex('#8E8E93'), size_hint_y=None, height=dp(30)))
         
@@ -1708,58 +4114,115 @@ class QRReceiptPopup(Popup):
         
         self.content = layout
 
-    def _bg(self, i):
-        i.canvas.before.clear()
-        with i.canvas.before:
-            Color(rgba=get_color_from_hex('#FFFFFF'))
-            RoundedRectangle(pos=i.pos, size=i.size, radius=[dp(20)])
+        if HAS_QRCODE:
+            qr_renderer.texture(receipt_url(client_id), self.show_qr)
+
+    def show_qr(self, texture):
+        self.qr_image.texture = texture
 
-class InventoryScreen(Screen):
+class InventoryScreen(JobScreen):
     def upsert(self):
         n = self.ids.p_name.text.strip()
         cat = self.ids.p_cat.text
         if cat == "Select Category": return
         try: p = float(self.ids.p_price.text)
         except: p = 0
+        # blank stock or barcode leaves what the product already has
         try: s = int(self.ids.p_stock.text)
-        except: s = 0
+        except: s = None
+        b = self.ids.p_barcode.text.strip() or None
         if n and p > 0:
-            try:
-                conn = get_db_connection()
+            def save_product(conn):
                 c = conn.cursor()
-                # insert new product
-                c.execute("INSERT INTO products (name, category, price, stock) VALUES (%s,%s,%s,%s)", (n, cat, p, s))
+                # a barcode on some other product would turn this save into an update of that one
+                if b:
+                    c.execute("SELECT name FROM products WHERE barcode = %s AND name <> %s", (b, n))
+                    taken = c.fetchone()
+                    if taken: raise ValueError(f"Barcode already on {taken[0]}")
+                # rowcount cannot tell insert from update here, the FOUND_ROWS client flag
+                # counts an unchanged row as 1, so look the name up first
+                c.execute("SELECT id FROM products WHERE name = %s", (n,))
+                existed = c.fetchone() is not None
+                # a new name inserts, a known one is updated in place. LAST_INSERT_ID(id)
+                # makes lastrowid the product's id either way
+                stock = ", stock = VALUES(stock)" if s is not None else ""
+                c.execute(f"""INSERT INTO products (name, category, price, stock, barcode) VALUES (%s,%s,%s,%s,%s)
+                              ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id), category = VALUES(category),
+                                                      price = VALUES(price){stock}, barcode = COALESCE(VALUES(barcode), barcode)""",
+                          (n, cat, p, s or 0, b))
+                c.execute("SELECT id, name, category, price, stock, barcode FROM products WHERE id = %s", (c.lastrowid,))
+                row = c.fetchone()
                 conn.commit()
-                conn.close()
-                self.ids.status.text = "Saved"
-                self.ids.p_name.text = ""
-            except mysql.connector.Error:
-                self.ids.status.text = "DB Error"
+                catalog.put(row)
+                return existed
+            db_executor.submit(save_product, self.on_saved, self.on_save_failed)
+
+    def on_saved(self, existed):
+        self.ids.status_label.text = "Updated" if existed else "Saved"
+        self.ids.p_name.text = ""
+        self.ids.p_barcode.text = ""
+
+    def on_save_failed(self, err):
+        self.ids.status_label.text = str(err) if isinstance(err, ValueError) else "DB Error"
+
+    def import_csv(self):
+        path = os.path.expanduser(self.ids.import_path.text.strip())
+        if not os.path.isfile(path):
+            self.ids.status_label.text = "No such file"
+            return
+        def done(result):
+            loaded, rejected, problems = result
+            if problems: print("\n".join(["Rejected rows:"] + problems))
+            return f"Imported {loaded:,} products" + (f", {rejected:,} rejected, first {problems[0]}" if rejected else "")
+        self.run_job(lambda progress: import_products(path, progress), done)
 
 class ReportScreen(Screen):
     def on_enter(self):
         self.generate_report()
 
     def generate_report(self):
-        self.ids.report_area.clear_widgets()
-        try:
-            conn = get_db_connection()
+        def load_report(conn):
             c = conn.cursor()
             # group payments by method
-            c.execute("SELECT method, SUM(amount), COUNT(*) FROM payments GROUP BY method")
-            group = ListGroup()
-            self.ids.report_area.add_widget(group)
-            for i, r in enumerate(c.fetchall()):
-                row = ListRow()
-                row.main_text = r[0].title()
-                row.value_text = f"Rs {r[1]:,.0f}"
-                row.is_last = False
-                group.add_widget(row)
-            conn.close()
-        except mysql.connector.Error:
-            pass
+            c.execute("SELECT method, amount, payment_count FROM payment_rollup WHERE period_type = 'all' ORDER BY method")
+            return c.fetchall()
+        db_executor.submit(load_report, self.show_report, key='report')
+
+    def show_report(self, rows):
+        self.ids.report_area.clear_widgets()
+        group = ListGroup()
+        self.ids.report_area.add_widget(group)
+        for i, r in enumerate(rows):
+            row = ListRow()
+            row.main_text = r[0].title()
+            row.value_text = f"Rs {r[1]:,.0f}"
+            row.is_last = False
+            group.add_widget(row)
+
+# one page of the product browser, in idx_products_category_name order
+def browse_products(conn, after, limit, search=""):
+    c = conn.cursor()
+    where, params = [], []
+    if after is not None:
+        where.append("(category, name, id) > (%s, %s, %s)")
+        params.extend(after)
+    if search:
+        where.append("name LIKE %s")
+        params.append(f"%{search}%")
+    query = "SELECT id, name, category, price, stock FROM products"
+    if where: query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY category, name, id LIMIT %s"
+    params.append(limit)
+    c.execute(query, tuple(params))
+    return c.fetchall()
 
 class DatabaseScreen(Screen):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.pager = KeysetPager(browse_products, self.add_products, key='products',
+                                 seek=lambda r: (r[2], r[1], r[0]))
+        self.clear_list()
+
     def on_enter(self):
         self.ids.search_box.text = ""
         self.show_products()
@@ -1767,146 +4230,802 @@ class DatabaseScreen(Screen):
     def on_search(self, instance, value):
         self.show_products(value)
 
+    def clear_list(self):
+        # offset from the top and title of each group header, for the sticky header
+        self._header_tops = []
+        self._header_names = []
+        self._list_height = 0
+        self._last_category = None
+
     def show_products(self, search=""):
-        self.ids.db_list.clear_widgets()
-        try:
-            conn = get_db_connection()
-            c = conn.cursor()
-            
-            # build query with optional filter
-            query = "SELECT name, category, price, stock FROM products"
-            params = []
-            if search:
-                query += " WHERE name LIKE %s"
-                params.append(f"%{search}%")
-            query += " ORDER BY category ASC, name ASC"
-            
-            c.execute(query, tuple(params))
-            rows = c.fetchall()
-            conn.close()
+        self.clear_list()
+        self.ids.db_list.data = []
+        self.ids.db_list.scroll_y = 1
+        self.ids.sticky_header.text = ""
+        self.ids.empty_msg.text = ""
+        # a newer keystroke supersedes the previous search
+        self.pager.reset(search)
+        self.pager.load_more()
 
-            # group by category
-            grouped_data = {}
-            for row in rows:
-                cat = row[1] if row[1] else "Uncategorized"
-                if cat not in grouped_data:
-                    grouped_data[cat] = []
-                grouped_data[cat].append(row)
-
-            if not grouped_data:
-                lbl = Label(text="No products found", color=(0.5,0.5,0.5,1), size_hint_y=None, height=dp(50))
-                self.ids.db_list.add_widget(lbl)
-                return
-
-            # render list
-            for category, items in grouped_data.items():
-                header = Label(
-                    text=category.upper(),
-                    color=get_color_from_hex('#8E8E93'),
-                    bold=True,
-                    font_size=sp(13),
-                    size_hint_y=None,
-                    height=dp(35),
-                    halign='left',
-                    valign='bottom',
-                    text_size=(self.width, None)
-                )
-                header.bind(size=lambda instance, val: setattr(instance, 'text_size', (instance.width, None)))
-                self.ids.db_list.add_widget(header)
-
-                group = ListGroup()
-                self.ids.db_list.add_widget(group)
-
-                for i, r in enumerate(items):
-                    row = ListRow()
-                    row.main_text = r[0] 
-                    row.sub_text = f"Rs {r[2]:,.2f}"
-                    row.value_text = f"{r[3]} left"
-                    # highlight low stock
-                    if r[3] < 20:
-                        row.value_text = f"[color=#FF3B30]{r[3]} left[/color]"
-                        row.markup = True
-                    if i == len(items) - 1:
-                        row.is_last = True
-                    group.add_widget(row)
-        except mysql.connector.Error:
-            pass
+    def add_products(self, rows, first):
+        if first and not rows:
+            self.ids.empty_msg.text = "No products found"
+            return
+        data = self.ids.db_list.data
+        page = []
+        for pid, name, category, price, stock in rows:
+            if category != self._last_category:
+                # the previous row closes its group's card
+                if page: page[-1]['is_last'] = True
+                elif data: data[-1] = dict(data[-1], is_last=True)
+                title = (category or "Uncategorized").upper()
+                self._header_tops.append(self._list_height)
+                self._header_names.append(title)
+                page.append({'viewclass': 'CategoryHeader', 'text': title, 'height': dp(35)})
+                self._list_height += dp(35)
+                self._last_category = category
+            # highlight low stock
+            value = f"{stock} left" if stock >= 20 else f"[color=#FF3B30]{stock} left[/color]"
+            page.append({'viewclass': 'BrowseRow', 'main_text': name, 'sub_text': f"Rs {price:,.2f}",
+                         'value_text': value, 'is_last': False, 'height': dp(52)})
+            self._list_height += dp(52)
+        if self.pager.done:
+            if page: page[-1]['is_last'] = True
+            elif data: data[-1] = dict(data[-1], is_last=True)
+        data.extend(page)
+        # keep paging until the list reaches past the bottom of the screen
+        Clock.schedule_once(lambda dt: self.on_list_scroll(self.ids.db_list), 0)
+
+    def on_list_scroll(self, rv):
+        # row heights are fixed, so offsets come from the running total rather than the layout
+        scrollable = max(0, self._list_height + dp(40) - rv.height)
+        from_top = (1 - rv.scroll_y) * scrollable
+        i = bisect.bisect_right(self._header_tops, from_top) - 1
+        self.ids.sticky_header.text = self._header_names[i] if from_top > 0 and i >= 0 else ""
+        if rv.scroll_y * scrollable < rv.height * BROWSE_CONFIG['prefetch_screens']:
+            self.pager.load_more()
+
+# one page of the customer directory, names starting with search, in idx_customers_name order
+def browse_customers(conn, after, limit, search=""):
+    c = conn.cursor()
+    where, params = [], []
+    if after is not None:
+        where.append("(name, id) > (%s, %s)")
+        params.extend(after)
+    if search:
+        where.append("name LIKE %s")
+        params.append(f"{search}%")
+    query = "SELECT id, name, phone FROM customers"
+    if where: query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY name, id LIMIT %s"
+    params.append(limit)
+    c.execute(query, tuple(params))
+    return c.fetchall()
 
 class CustomerScreen(Screen):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.pager = KeysetPager(browse_customers, self.add_customers, key='customers',
+                                 seek=lambda r: (r[1], r[0]))
+        self._list_height = 0
+
     def on_enter(self):
-        self.show_customers()
+        # only the first page is fetched, so reopening stays cheap at any directory size
+        self.show_customers(self.ids.cust_search.text)
     def add_customer(self):
         n = self.ids.c_name.text.strip()
         p = self.ids.c_phone.text.strip()
         e = self.ids.c_email.text.strip()
         if n:
-            try:
-                conn = get_db_connection()
+            def save_customer(conn):
                 c = conn.cursor()
                 c.execute("INSERT INTO customers (name, phone, email) VALUES (%s,%s,%s)", (n, p, e))
                 conn.commit()
-                conn.close()
-                self.ids.status.text = "Saved"
-            except mysql.connector.Error:
-                self.ids.status.text = "DB Error"
-    def show_customers(self):
-        self.ids.cust_list.clear_widgets()
-        try:
-            conn = get_db_connection()
-            c = conn.cursor()
-            c.execute("SELECT name, phone FROM customers ORDER BY name")
-            group = ListGroup()
-            self.ids.cust_list.add_widget(group)
-            for r in c.fetchall():
-                row = ListRow()
-                row.main_text = r[0]
-                row.value_text = r[1]
-                row.is_last = False
-                group.add_widget(row)
-            conn.close()
-        except mysql.connector.Error:
-            pass
+            db_executor.submit(save_customer, self.on_saved, self.on_save_failed)
+    def on_saved(self, result):
+        self.ids.status.text = "Saved"
+        self.show_customers(self.ids.cust_search.text)
+    def on_save_failed(self, err):
+        self.ids.status.text = "DB Error"
+    def show_customers(self, search=""):
+        self._list_height = 0
+        self.ids.cust_list.data = []
+        self.ids.cust_list.scroll_y = 1
+        self.ids.empty_msg.text = ""
+        self.pager.reset(search.strip())
+        self.pager.load_more()
+    def add_customers(self, rows, first):
+        if first and not rows:
+            self.ids.empty_msg.text = "No contacts found"
+            return
+        data = self.ids.cust_list.data
+        page = [{'viewclass': 'BrowseRow', 'main_text': name, 'sub_text': '', 'value_text': phone or '',
+                 'is_last': False, 'height': dp(52)} for cid, name, phone in rows]
+        self._list_height += dp(52) * len(page)
+        if self.pager.done:
+            if page: page[-1]['is_last'] = True
+            elif data: data[-1] = dict(data[-1], is_last=True)
+        data.extend(page)
+        Clock.schedule_once(lambda dt: self.on_list_scroll(self.ids.cust_list), 0)
+    def on_list_scroll(self, rv):
+        scrollable = max(0, self._list_height + dp(50) - rv.height)
+        if rv.scroll_y * scrollable < rv.height * BROWSE_CONFIG['prefetch_screens']:
+            self.pager.load_more()
+
+class SettingsScreen(JobScreen):
+    def on_enter(self):
+        # default export range is this month so far
+        today = datetime.date.today()
+        if not self.ids.export_from.text: self.ids.export_from.text = str(today.replace(day=1))
+        if not self.ids.export_to.text: self.ids.export_to.text = str(today)
 
-class SettingsScreen(Screen):
     def backup_db(self):
-        self.ids.status_label.text = "Backup Done"
+        self.run_job(lambda progress: backup_database(progress=progress),
+                     lambda path: f"Backed up to {os.path.basename(path)}")
+
     def export_csv(self):
-        self.ids.status_label.text = "Export Done"
+        try:
+            start = datetime.date.fromisoformat(self.ids.export_from.text.strip())
+            end = datetime.date.fromisoformat(self.ids.export_to.text.strip()) + datetime.timedelta(days=1)
+        except ValueError:
+            self.ids.status_label.text = "Dates look like 2024-01-31"
+            return
+        if end <= start:
+            self.ids.status_label.text = "The range ends before it starts"
+            return
+        self.run_job(lambda progress: export_sales(start, end, progress=progress),
+                     lambda path: f"Exported to {path}")
     def show_about(self):
         popup = Popup(title="", size_hint=(0.7, 0.4), separator_height=0)
         layout = BoxLayout(orientation='vertical', padding=dp(20), spacing=dp(10))
-        with layout.canvas.before:
-            Color(rgba=get_color_from_hex('#FFFFFF'))
-            rect = RoundedRectangle(pos=(0,0), size=(100,100), radius=[dp(16)])
-            
-        def update_rect(instance, value):
-            rect.pos = instance.pos
-            rect.size = instance.size
-        
-        layout.bind(pos=update_rect, size=update_rect)
+        rounded_background(layout, '#FFFFFF', dp(16))
         
         layout.add_widget(Label(text="SwiftSale v2.2", font_size=sp(20), bold=True, color=get_color_from_hex('#1D1D1F')))
         layout.add_widget(Label(text="Enterprise Point of Sale", color=get_color_from_hex('#8E8E93'), halign='center'))
+        layout.add_widget(Label(text=f"Receipt server: {receipt_server.status}", color=get_color_from_hex('#8E8E93'), font_size=sp(13), halign='center'))
         btn = Button(text="Close", size_hint_y=None, height=dp(44), background_color=get_color_from_hex('#007AFF'))
         btn.bind(on_release=popup.dismiss)
         layout.add_widget(btn)
         popup.content = layout
         popup.open()
 
+# where the till's database time goes, read straight from query_metrics
+class DiagnosticsScreen(Screen):
+    def on_enter(self):
+        self.refresh()
+        self._tick = Clock.schedule_interval(lambda dt: self.refresh(), METRICS_CONFIG['refresh_interval'])
+
+    def on_leave(self):
+        self._tick.cancel()
+
+    def reset(self):
+        query_metrics.reset()
+        self.refresh()
+
+    def refresh(self):
+        acquire, series = query_metrics.snapshot()
+        if not query_metrics.enabled:
+            self.ids.summary.text = "Query metrics are switched off in METRICS_CONFIG"
+        else:
+            in_use, idle = db_pool.stats()
+            self.ids.summary.text = (f"{sum(h.count for _, _, h in series):,} statements, "
+                                     f"pool wait p95 {_ms(acquire.quantile(0.95))}, {in_use} in use / {idle} idle")
+        self.ids.query_list.data = [
+            {'viewclass': 'BrowseRow', 'main_text': site, 'sub_text': fp,
+             'value_text': f"{_ms(hist.quantile(0.95))} p95 · {hist.count:,}x · {hist.sum:.1f}s"}
+            for fp, site, hist in series]
+
+def _ms(seconds):
+    if seconds == math.inf: return "slow"
+    return f"{seconds * 1000:g} ms"
+
+# screens by name, each is built with its SCREEN_KV rules the first time it is shown
+SCREENS = {
+    'login': LoginScreen,
+    'dashboard': DashboardScreen,
+    'pos': POSScreen,
+    'inventory': InventoryScreen,
+    'reports': ReportScreen,
+    'database': DatabaseScreen,
+    'customers': CustomerScreen,
+    'settings': SettingsScreen,
+    'diagnostics': DiagnosticsScreen
+}
+
+class LazyScreenManager(ScreenManager):
+    def ensure_screen(self, name):
+        if name not in SCREENS or self.has_screen(name): return
+        started = time.perf_counter()
+        Builder.load_string(SCREEN_KV[name])
+        self.add_widget(SCREENS[name](name=name))
+        startup.mark(f"{name} screen built", time.perf_counter() - started)
+
+    def on_current(self, instance, value):
+        self.ensure_screen(value)
+        super().on_current(instance, value)
+
 class SwiftApp(App):
     def build(self):
-        init_db()
+        Builder.load_string(KV)
+        startup.mark("shared kv loaded")
         Window.clearcolor = get_color_from_hex('#F4F7FE')
-        sm = ScreenManager(transition=NoTransition())
-        sm.add_widget(LoginScreen(name='login'))
-        sm.add_widget(DashboardScreen(name='dashboard'))
-        sm.add_widget(POSScreen(name='pos'))
-        sm.add_widget(InventoryScreen(name='inventory'))
-        sm.add_widget(ReportScreen(name='reports'))
-        sm.add_widget(DatabaseScreen(name='database'))
-        sm.add_widget(CustomerScreen(name='customers'))
-        sm.add_widget(SettingsScreen(name='settings'))
+        sm = LazyScreenManager(transition=NoTransition())
+        sm.current = 'login'
         return sm
 
+    def on_start(self):
+        # report once the login screen has actually been drawn
+        Window.bind(on_flip=self.first_frame)
+        threading.Thread(target=self.prepare_backend, daemon=True, name='swiftsale-startup').start()
+
+        # build the product index in the background, then keep it topped up
+        db_executor.submit(catalog.load)
+        Clock.schedule_interval(lambda dt: db_executor.submit(catalog.refresh, key='catalog'), CATALOG_CONFIG['refresh_interval'])
+
+        # a fresh start has an empty cart, drop whatever this till held before, then
+        # keep returning stock from baskets abandoned on any till
+        db_executor.submit(lambda conn: run_transaction(conn, release_reservations))
+        Clock.schedule_interval(lambda dt: db_executor.submit(lambda conn: run_transaction(conn, sweep_reservations), key='sweep'),
+                                RESERVATION_CONFIG['sweep_interval'])
+
+    def first_frame(self, window):
+        window.unbind(on_flip=self.first_frame)
+        startup.mark("first frame")
+        startup.report()
+
+    def prepare_backend(self):
+        # schema checks and the receipt server stay off the launch path, db work
+        # queued meanwhile waits on schema_ready. the journal opens first, it is all checkout needs
+        if sales_journal.path:
+            try:
+                sales_journal.open()
+            except Exception as err:
+                print(f"Error opening the sales journal: {err}")
+        started = time.perf_counter()
+        try:
+            init_db()
+        except Exception as err:
+            print(f"Error preparing database: {err}")
+        finally:
+            schema_ready.set()
+        startup.mark("schema ready", time.perf_counter() - started)
+        started = time.perf_counter()
+        if receipt_server.start():
+            startup.mark("receipt server up", time.perf_counter() - started)
+
+    def on_stop(self):
+        receipt_server.stop()
+        if sales_journal.path: sales_journal.close()
+        qr_renderer.shutdown()
+        db_executor.shutdown()
+        db_pool.close_all()
+
+# staging data generator settings, each can be overridden on the command line
+DATAGEN_CONFIG = {
+    'products': 2000,
+    'customers': 50000,
+    'sales': 1000000,
+    'days': 365,
+    'max_items': 5,
+    'batch': 2000,
+    'seed': 0
+}
+
+PAYMENT_METHODS = ['cash', 'cash', 'card', 'upi', 'upi']
+
+# fills a staging database with a realistic catalog, customer base and sales history,
+# written as multi-row inserts and committed a batch at a time
+def generate_data(conn, products, customers, sales, days, max_items, batch, seed=0):
+    rng = random.Random(seed)
+    c = conn.cursor()
+    # bulk load on a dedicated connection, the checks come back when it closes
+    storage.bulk_load(c)
+
+    for start in range(0, products, batch):
+        rows = []
+        for i in range(start, min(start + batch, products)):
+            name, category, price, _ = rng.choice(DEMO_PRODUCTS)
+            # ean-13 sized codes in the 890 (india) range
+            rows.append((f"{name} #{i + 1}", category, round(price * rng.uniform(0.8, 1.25), 2), rng.randint(0, 500),
+                         str(8900000000000 + i)))
+        # a rerun updates the products an earlier run made rather than hitting their names
+        insert_rows(c, 'products', ('name', 'category', 'price', 'stock', 'barcode'), rows,
+                    update=('category', 'price', 'stock'))
+        conn.commit()
+    for start in range(0, customers, batch):
+        insert_rows(c, 'customers', ('name', 'phone', 'email'),
+                    [demo_customer(rng) for i in range(start, min(start + batch, customers))])
+        conn.commit()
+    print(f"Generated {products:,} products and {customers:,} customers")
+
+    c.execute("SELECT id, name, price FROM products")
+    catalog_rows = c.fetchall()
+    c.execute("SELECT id FROM customers")
+    customer_ids = [r[0] for r in c.fetchall()] + [0]
+    # sales get their ids up front so items and payments need no lastrowid round trip
+    c.execute("SELECT COALESCE(MAX(id), 0) FROM sales")
+    next_id = c.fetchone()[0] + 1
+    first_day = datetime.datetime.now() - datetime.timedelta(days=days)
+
+    for start in range(0, sales, batch):
+        sale_rows, item_rows, payment_rows = [], [], []
+        for sale_id in range(next_id + start, next_id + min(start + batch, sales)):
+            # opening hours only, 9am to 10pm
+            when = (first_day + datetime.timedelta(days=rng.randrange(days), hours=rng.randint(9, 21), seconds=rng.randrange(3600)))
+            dt = when.strftime("%Y-%m-%d %H:%M:%S")
+            subtotal = Decimal(0)
+            for pid, name, price in rng.sample(catalog_rows, rng.randint(1, max_items)):
+                qty = rng.choice((1, 1, 1, 2, 2, 3))
+                item_rows.append((sale_id, pid, name, qty, price))
+                subtotal += price * qty
+            discount = to_money(subtotal * rng.choice((0, 0, 0, 0, Decimal('0.05'), Decimal('0.10'))))
+            total = subtotal - discount
+            sale_rows.append((sale_id, dt, total, discount, rng.choice(customer_ids)))
+            payment_rows.append((sale_id, rng.choice(PAYMENT_METHODS), total, dt))
+        insert_rows(c, 'sales', ('id', 'date', 'total', 'discount', 'customer_id'), sale_rows)
+        insert_rows(c, 'sales_items', ('sale_id', 'product_id', 'product_name', 'qty', 'price'), item_rows)
+        insert_rows(c, 'payments', ('sale_id', 'method', 'amount', 'timestamp'), payment_rows)
+        conn.commit()
+        done = min(start + batch, sales)
+        if done % (batch * 50) == 0 or done == sales: print(f"Generated {done:,} of {sales:,} sales")
+
+    rebuild_rollups(conn)
+    conn.commit()
+    print("Rollups rebuilt")
+
+# backup settings, an archive is gzipped json lines closed by a sha256 of everything before it
+BACKUP_CONFIG = {
+    'dir': 'backups',
+    'chunk': 5000,
+    'restore_batch': 5000,
+    'compresslevel': 6
+}
+
+# restored in this order, so a sale goes in before its items and payments.
+# rollups are rebuilt after a restore rather than archived
+BACKUP_TABLES = ['users', 'products', 'customers', 'sales', 'sales_items', 'payments']
+
+def _json_value(value):
+    # DECIMAL and DATETIME go out as text, mysql reads them back as-is
+    if isinstance(value, (Decimal, datetime.date, datetime.timedelta)): return str(value)
+    if isinstance(value, (bytes, bytearray)): return value.decode('utf-8', 'replace')
+    raise TypeError(f"can't archive {type(value).__name__}")
+
+class BackupWriter:
+    def __init__(self, f):
+        self.f = f
+        self.sha = hashlib.sha256()
+
+    def write(self, record):
+        line = (json.dumps(record, default=_json_value, separators=(',', ':')) + "\n").encode()
+        self.sha.update(line)
+        self.f.write(line)
+
+    def close(self):
+        self.f.write((json.dumps({'sha256': self.sha.hexdigest()}) + "\n").encode())
+
+def backup_database(path=None, progress=None):
+    # progress(fraction, text) is called from this thread
+    if path is None:
+        os.makedirs(BACKUP_CONFIG['dir'], exist_ok=True)
+        path = os.path.join(BACKUP_CONFIG['dir'], datetime.datetime.now().strftime("swiftsale-%Y%m%d-%H%M%S.jsonl.gz"))
+    tmp = path + ".part"
+    # its own connection, a backup can hold one for minutes
+    conn = get_db_connection()
+    try:
+        c = conn.cursor()
+        # row estimates are enough for a progress bar
+        estimates = storage.table_rows(c)
+        total = max(1, sum(estimates.get(t, 0) for t in BACKUP_TABLES))
+        # that select opened a transaction (autocommit is off), end it so the snapshot below is the first one
+        conn.commit()
+        # every table is read from one snapshot, so the archive is a single moment even while tills sell
+        conn.start_transaction(consistent_snapshot=True, isolation_level='REPEATABLE READ', readonly=True)
+        done = 0
+        with gzip.open(tmp, 'wb', compresslevel=BACKUP_CONFIG['compresslevel']) as f:
+            out = BackupWriter(f)
+            out.write({'format': 'swiftsale-backup', 'version': 1, 'schema': SCHEMA_FINGERPRINT,
+                       'created': datetime.datetime.now().isoformat(timespec='seconds'), 'tables': BACKUP_TABLES})
+            for table in BACKUP_TABLES:
+                # unbuffered, rows come off the socket a chunk at a time rather than all at once
+                cur = conn.cursor(buffered=False)
+                cur.execute(f"SELECT * FROM {table}")
+                out.write({'table': table, 'columns': list(cur.column_names)})
+                count = 0
+                while True:
+                    rows = cur.fetchmany(BACKUP_CONFIG['chunk'])
+                    if not rows: break
+                    for row in rows: out.write(row)
+                    count += len(rows)
+                    done += len(rows)
+                    if progress: progress(min(done / total, 0.99), f"Backing up {table}: {count:,} rows")
+                cur.close()
+                out.write({'end': table, 'rows': count})
+            out.close()
+        conn.rollback()
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+    finally:
+        conn.close()
+    if progress: progress(1, "Backup complete")
+    return path
+
+def verify_backup(path):
+    # reads the whole archive once, so a damaged or cut-off file is refused before anything is replaced
+    sha = hashlib.sha256()
+    last = None
+    with gzip.open(path, 'rb') as f:
+        for line in f:
+            if last is not None: sha.update(last)
+            last = line
+    try:
+        trailer = json.loads(last) if last else {}
+    except ValueError:
+        trailer = {}
+    if not isinstance(trailer, dict) or trailer.get('sha256') != sha.hexdigest():
+        raise ValueError(f"{path} is damaged or incomplete")
+
+def restore_database(path, progress=None):
+    verify_backup(path)
+    size = max(1, os.path.getsize(path))
+    batch = BACKUP_CONFIG['restore_batch']
+    conn = get_db_connection()
+    try:
+        c = conn.cursor()
+        # bulk load, this connection only, the checks come back when it closes
+        storage.bulk_load(c)
+        with gzip.open(path, 'rb') as f:
+            header = json.loads(f.readline())
+            if header.get('format') != 'swiftsale-backup':
+                raise ValueError(f"{path} is not a SwiftSale backup")
+            if header.get('schema') != SCHEMA_FINGERPRINT:
+                print("Backup was taken on a different schema version, restoring the columns it has")
+            for table in header['tables']:
+                storage.truncate(c, table)
+            table, columns, rows = None, None, []
+            for line in f:
+                record = json.loads(line)
+                if isinstance(record, list):
+                    rows.append(record)
+                    if len(rows) < batch: continue
+                elif 'table' in record:
+                    table, columns = record['table'], record['columns']
+                    continue
+                elif 'sha256' in record:
+                    break
+                # a full batch or the end of a table, one multi-row insert and commit
+                if rows:
+                    insert_rows(c, table, columns, rows)
+                    conn.commit()
+                    rows = []
+                # fileobj is the compressed file, how far into it we are is close enough
+                if progress: progress(min(f.fileobj.tell() / size, 0.99), f"Restoring {table}")
+        # archived rows carried the reservations of that moment, none of them are held now
+        c.execute("DELETE FROM stock_reservations")
+        c.execute("UPDATE products SET reserved = 0")
+        rebuild_rollups(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    if progress: progress(1, "Restore complete")
+
+# sales export settings, each table is written as one part per 'chunk_days' of the range
+EXPORT_CONFIG = {
+    'dir': 'exports',
+    'chunk_days': 1,
+    'fetch': 5000,
+    'formats': ('csv', 'parquet')
+}
+
+# what each export holds, all three select by sales.date so they ride idx_sales_date.
+# column kinds are int, money, time and text
+EXPORT_TABLES = {
+    'sales': ("""SELECT s.id, s.date, s.total, s.discount, s.customer_id FROM sales s
+                 WHERE s.date >= %s AND s.date < %s ORDER BY s.date, s.id""",
+              [('id', 'int'), ('date', 'time'), ('total', 'money'), ('discount', 'money'), ('customer_id', 'int')]),
+    'sales_items': ("""SELECT si.id, si.sale_id, si.product_id, si.product_name, si.qty, si.price
+                       FROM sales s JOIN sales_items si ON si.sale_id = s.id
+                       WHERE s.date >= %s AND s.date < %s ORDER BY s.date, s.id""",
+                    [('id', 'int'), ('sale_id', 'int'), ('product_id', 'int'), ('product_name', 'text'),
+                     ('qty', 'int'), ('price', 'money')]),
+    'payments': ("""SELECT p.id, p.sale_id, p.method, p.reference, p.amount, p.timestamp
+                    FROM sales s JOIN payments p ON p.sale_id = s.id
+                    WHERE s.date >= %s AND s.date < %s ORDER BY s.date, s.id""",
+                 [('id', 'int'), ('sale_id', 'int'), ('method', 'text'), ('reference', 'text'),
+                  ('amount', 'money'), ('timestamp', 'time')]),
+}
+
+@query_metrics.skip
+def stream_rows(conn, query, params, size):
+    # rows straight off an unbuffered cursor, one fetch of 'size' at a time
+    cur = conn.cursor(buffered=False)
+    try:
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(size)
+            if not rows: return
+            yield rows
+    finally:
+        cur.close()
+
+def _arrow_schema(columns):
+    kinds = {'int': pyarrow.int64(), 'money': pyarrow.decimal128(14, 2), 'time': pyarrow.timestamp('s'), 'text': pyarrow.string()}
+    return pyarrow.schema([(name, kinds[kind]) for name, kind in columns])
+
+def export_part(conn, table, start, end, path, formats):
+    # one table for one slice of days, written under temporary names and renamed when whole
+    query, columns = EXPORT_TABLES[table]
+    names = [name for name, _ in columns]
+    outputs = []
+    writer = parquet = None
+    try:
+        if 'csv' in formats:
+            outputs.append((path + ".csv.gz.part", path + ".csv.gz"))
+            csv_file = gzip.open(outputs[-1][0], 'wt', newline='')
+            writer = csv.writer(csv_file)
+            writer.writerow(names)
+        if 'parquet' in formats:
+            outputs.append((path + ".parquet.part", path + ".parquet"))
+            schema = _arrow_schema(columns)
+            parquet = pyarrow.parquet.ParquetWriter(outputs[-1][0], schema, compression='zstd')
+        for rows in stream_rows(conn, query, (start, end), EXPORT_CONFIG['fetch']):
+            if writer: writer.writerows(rows)
+            if parquet:
+                # each fetch becomes a row group, columns are built from this batch only
+                batch = dict(zip(names, map(list, zip(*rows))))
+                parquet.write_table(pyarrow.Table.from_pydict(batch, schema=schema))
+    except BaseException:
+        for tmp, _ in outputs:
+            if os.path.exists(tmp): os.remove(tmp)
+        raise
+    finally:
+        if writer: csv_file.close()
+        if parquet: parquet.close()
+    for tmp, final in outputs:
+        os.replace(tmp, final)
+
+def export_sales(start, end, out_dir=None, progress=None):
+    # sales, items and payments from start up to (not including) end, one thread and
+    # connection per table. finished parts of days that are over are listed in manifest.json,
+    # so running the same range again picks up where an interrupted export stopped and
+    # redoes any part that could still gain sales
+    out_dir = out_dir or os.path.join(EXPORT_CONFIG['dir'], f"{start:%Y-%m-%d}_{end:%Y-%m-%d}")
+    # parquet needs pyarrow, without it the export is csv only
+    formats = [f for f in EXPORT_CONFIG['formats'] if f != 'parquet' or HAS_PYARROW]
+    step = datetime.timedelta(days=EXPORT_CONFIG['chunk_days'])
+    days = []
+    day = start
+    while day < end:
+        days.append(day)
+        day += step
+
+    manifest = os.path.join(out_dir, "manifest.json")
+    try:
+        with open(manifest) as f:
+            finished = set(json.load(f)['done'])
+    except (OSError, ValueError, KeyError):
+        finished = set()
+    for table in EXPORT_TABLES:
+        os.makedirs(os.path.join(out_dir, table), exist_ok=True)
+    todo = {table: [d for d in days if f"{table}/{d:%Y-%m-%d}" not in finished] for table in EXPORT_TABLES}
+    total = max(1, len(EXPORT_TABLES) * len(days))
+    exported = [total - sum(len(parts) for parts in todo.values())]
+    today = datetime.date.today()
+    lock = threading.Lock()
+
+    def record(part, closed):
+        with lock:
+            exported[0] += 1
+            count = exported[0]
+            if closed:
+                finished.add(part)
+                with open(manifest + ".tmp", 'w') as f:
+                    json.dump({'start': str(start), 'end': str(end), 'formats': list(formats), 'done': sorted(finished)}, f)
+                os.replace(manifest + ".tmp", manifest)
+        if progress: progress(min(count / total, 0.99), f"Exported {count} of {total} parts")
+
+    def export_table(table):
+        conn = get_db_connection()
+        try:
+            for day in todo[table]:
+                name = f"{table}/{day:%Y-%m-%d}"
+                part_end = min(day + step, end)
+                export_part(conn, table, day, part_end, os.path.join(out_dir, name), formats)
+                # a part reaching into today can still gain sales, it is written but not marked done
+                record(name, part_end <= today)
+        finally:
+            conn.close()
+
+    with ThreadPoolExecutor(max_workers=len(EXPORT_TABLES), thread_name_prefix='swiftsale-export') as pool:
+        for future in [pool.submit(export_table, table) for table in EXPORT_TABLES]:
+            future.result()
+    if progress: progress(1, "Export complete")
+    return out_dir
+
+# price list import settings, 'batch' rows per INSERT and 'commit_every' INSERTs per transaction
+IMPORT_CONFIG = {
+    'batch': 1000,
+    'commit_every': 20,
+    'max_errors': 20
+}
+
+def parse_product_row(row, has_stock, has_barcode=False):
+    # (name, category, price, stock[, barcode]) from one csv row, or raises ValueError saying what is wrong.
+    # stock is 0 when the file has none, which only new products take
+    name = (row.get('name') or '').strip()
+    if not name: raise ValueError("no name")
+    if len(name) > 255: raise ValueError("name is over 255 characters")
+    try:
+        price = to_money(row.get('price') or '')
+        # nan gets through quantize and would only blow up at the comparison below
+        if not price.is_finite(): raise ArithmeticError
+    except ArithmeticError:
+        raise ValueError(f"price {row.get('price')!r} is not a number")
+    if not Decimal(0) < price < Decimal('100000000'): raise ValueError(f"price {price} is out of range")
+    category = (row.get('category') or '').strip()[:100]
+    stock = 0
+    if has_stock:
+        try:
+            stock = int(row.get('stock') or 0)
+        except ValueError:
+            raise ValueError(f"stock {row.get('stock')!r} is not a whole number")
+        if stock < 0: raise ValueError("stock is negative")
+    parsed = (name, category, price, stock)
+    if has_barcode:
+        code = (row.get('barcode') or '').strip()
+        if len(code) > 64: raise ValueError("barcode is over 64 characters")
+        parsed += (code or None,)
+    return parsed
+
+def split_barcode_clashes(c, rows):
+    # rows end in a barcode. one already on a product of another name would turn the row
+    # into an update of that product, so those rows are held back, as are two names sharing
+    # a code within the batch. returns (rows to write, problems)
+    codes = sorted({row[-1] for row in rows if row[-1]})
+    owners = {}
+    if codes:
+        c.execute(f"SELECT barcode, name FROM products WHERE barcode IN ({_id_list(codes)}) FOR UPDATE", codes)
+        owners = dict(c.fetchall())
+    kept, problems = [], []
+    for row in rows:
+        owner = owners.setdefault(row[-1], row[0]) if row[-1] else row[0]
+        # names compare the way the unique index does
+        if owner.casefold() != row[0].casefold():
+            problems.append(f"{row[0]}: barcode {row[-1]} is already on {owner}")
+        else:
+            kept.append(row)
+    return kept, problems
+
+def import_products(path, progress=None):
+    # streams a csv with name and price columns, category, stock and barcode optional. each name is
+    # inserted or, when it already exists, updated. products keep their stock when the file
+    # has no stock column. returns (loaded, rejected, first few problems)
+    size = max(1, os.path.getsize(path))
+    batch, commit_every = IMPORT_CONFIG['batch'], IMPORT_CONFIG['commit_every']
+    loaded, rejected, problems = 0, 0, []
+    conn = get_db_connection()
+    try:
+        with open(path, 'rb') as raw:
+            reader = csv.DictReader(io.TextIOWrapper(raw, encoding='utf-8-sig', newline=''))
+            fields = [(f or '').strip().lower() for f in reader.fieldnames or []]
+            if 'name' not in fields or 'price' not in fields:
+                raise ValueError("the file needs a header row with name and price columns")
+            reader.fieldnames = fields
+            has_stock, has_barcode = 'stock' in fields, 'barcode' in fields
+            columns = ('name', 'category', 'price', 'stock') + (('barcode',) if has_barcode else ())
+            # new products always get a stock figure, existing ones only when the file has one.
+            # a blank barcode cell keeps the barcode the product already has
+            update = ('category', 'price') + (('stock',) if has_stock else ())
+            if has_barcode: update += (('barcode', "COALESCE(VALUES(barcode), barcode)"),)
+
+            def write(batches):
+                # one transaction, retried whole on a deadlock. returns (rows written, problems)
+                def upsert(c):
+                    written, clashes = 0, []
+                    for rows in batches:
+                        if has_barcode:
+                            rows, bad = split_barcode_clashes(c, rows)
+                            clashes += bad
+                        if rows: insert_rows(c, 'products', columns, rows, update=update)
+                        written += len(rows)
+                    return written, clashes
+                return run_transaction(conn, upsert)
+
+            def record(result):
+                nonlocal loaded, rejected
+                written, clashes = result
+                loaded += written
+                rejected += len(clashes)
+                problems.extend(clashes[:max(0, IMPORT_CONFIG['max_errors'] - len(problems))])
+
+            pending, rows = [], []
+            for row in reader:
+                try:
+                    rows.append(parse_product_row(row, has_stock, has_barcode))
+                except ValueError as err:
+                    rejected += 1
+                    if len(problems) < IMPORT_CONFIG['max_errors']: problems.append(f"line {reader.line_num}: {err}")
+                if len(rows) == batch:
+                    pending.append(rows)
+                    rows = []
+                if len(pending) == commit_every:
+                    record(write(pending))
+                    pending = []
+                    # the raw file position runs a buffer ahead of the parser, near enough for a bar
+                    if progress: progress(min(raw.tell() / size, 0.99), f"Imported {loaded:,} products")
+            if rows: pending.append(rows)
+            if pending: record(write(pending))
+        # prices and names changed in place, the index needs a full reload rather than a top-up
+        catalog.load(conn)
+    finally:
+        conn.close()
+    if progress: progress(1, f"Imported {loaded:,} products")
+    return loaded, rejected, problems
+
+# progress for the command line, a line per whole percent
+def print_progress():
+    shown = [-1]
+    def report(fraction, text):
+        percent = int(fraction * 100)
+        if percent != shown[0]:
+            shown[0] = percent
+            print(f"{percent:3d}%  {text}")
+    return report
+
+# maintenance commands go after kivy's own options, eg. python "Swift Sale.py" -- --rebuild-rollups
+def run_command(args):
+    if args == ['--rebuild-rollups']:
+        init_db()
+        with db_connection() as conn:
+            rebuild_rollups(conn)
+            conn.commit()
+        print("Rollups rebuilt")
+        return True
+    if args[:1] == ['--backup'] and len(args) <= 2:
+        init_db()
+        path = backup_database(args[1] if len(args) == 2 else None, print_progress())
+        print(f"Backed up to {path}")
+        return True
+    if args[:1] == ['--restore'] and len(args) == 2:
+        # run with every till closed, the tables are replaced wholesale
+        init_db()
+        restore_database(args[1], print_progress())
+        print(f"Restored {args[1]}")
+        return True
+    if args[:1] == ['--export'] and len(args) in (3, 4):
+        # eg. -- --export 2024-04-01 2024-06-30, both days included
+        start = datetime.date.fromisoformat(args[1])
+        end = datetime.date.fromisoformat(args[2]) + datetime.timedelta(days=1)
+        init_db()
+        path = export_sales(start, end, args[3] if len(args) == 4 else None, print_progress())
+        print(f"Exported to {path}")
+        return True
+    if args[:1] == ['--import-products'] and len(args) == 2:
+        init_db()
+        loaded, rejected, problems = import_products(args[1], print_progress())
+        print(f"Imported {loaded:,} products, rejected {rejected:,} rows")
+        for problem in problems: print(f"  {problem}")
+        return True
+    if args[:1] == ['--generate-data']:
+        # eg. -- --generate-data sales=5000000 customers=200000
+        options = dict(DATAGEN_CONFIG)
+        for arg in args[1:]:
+            key, _, value = arg.partition('=')
+            if key not in options or not value.isdigit():
+                print(f"Expected name=number with name one of {', '.join(options)}, got {arg}")
+                return True
+            options[key] = int(value)
+        init_db()
+        conn = get_db_connection()
+        try:
+            generate_data(conn, **options)
+        finally:
+            conn.close()
+        return True
+    return False
+
 if __name__ == '__main__':
-    SwiftApp().run()
\ No newline at end of file
+    if not run_command(sys.argv[1:]):
+        SwiftApp().run()
\ No newline at end of file